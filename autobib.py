@@ -6,8 +6,8 @@ import re
 import os
 import ast
 import sys
-import json
 import argparse
+import concurrent.futures
 
 # Third party libs
 import colorama
@@ -19,7 +19,6 @@ from bibtexparser.bibdatabase import BibDatabase
 import config
 import utils
 import nomenclature
-import providers
 
 # Python 2/3 compatibility
 try:
@@ -27,6 +26,9 @@ try:
 except NameError:
     pass
 
+# Backup files written by utils.write_with_backup
+BACKUP_RE = re.compile('\\.bak(\\.[0-9]+)?$')
+
 
 def query_crossref_folder(folder, use_backup):
     """
@@ -42,37 +44,72 @@ def query_crossref_folder(folder, use_backup):
         folder (and backup previous database if it differed).
     """
 
+    # Online providers are slow to import, only load them when needed
+    import providers
+
     # Create database
-    db = utils.read_bib_file(os.path.join(folder, '.queried.bib'))
+    bib_path = os.path.join(folder, '.queried.bib')
+    db = utils.read_bib_file(bib_path)
     files = utils.guess_manual_files(folder, db, update_queried_db=False)
     utils.add_skip_files(folder, files)
     json_entries = []
     rejected = []
 
-    # For each pdf in the folder
+    # Collect the pdfs in the folder that need to be queried
+    tasks = []
     for path in utils.get_pdf_list(folder):
         file = os.path.basename(path)
         parsed = nomenclature.parse_filename(file)
         if parsed is None or file in files:
             continue
-        print('Q: ' + os.path.basename(file))
         authors, title = parsed
-
-        # Crossref
-        rbib, rjson, score = providers.crossref_query(authors, title)
+        tasks.append((file, authors, title))
+
+    # Crossref (queries missing from the cache are sent concurrently)
+    def query(authors, title):
+        output = []
+        return providers.crossref_query(authors, title, output), output
+
+    results = {}
+    with utils.query_cache(folder) as cache, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=config.crossref_max_workers) as executor:
+        futures = []
+        for file, authors, title in tasks:
+            key = utils.query_cache_key(authors, title)
+            cached = utils.query_cache_get(cache, 'crossref', key)
+            if cached is None:
+                futures.append((executor.submit(query, authors, title), file, key))
+            else:
+                results[file] = cached
+        # Report the results in the order of the pdfs, along with their filename
+        for future, file, key in futures:
+            print('Q: ' + file)
+            try:
+                results[file], output = future.result()
+            except Exception as e:
+                print(termcolor.colored('query failed: ', 'red') + str(e))
+                continue
+            for line in output:
+                print(line)
+            utils.query_cache_put(cache, 'crossref', key, *results[file])
+
+    # Store entries in the order of the pdfs
+    for file, _authors, _title in tasks:
+        if file not in results:
+            continue
+        rbib, rjson, score = results[file]
         if score >= config.crossref_accept_threshold:
             # Append filename and store entry
             rbib['file'] = utils.encode_filename_field(file)
             json_entries.append(rjson)
             db.entries.append(rbib)
         else:
-            rejected.append(os.path.basename(file))
+            rejected.append(file)
 
     # Store results
-    bib_path = os.path.join(folder, '.queried.bib')
     utils.write_with_backup(bib_path, utils.write_bib(db, order=False), use_backup)
     json_path = os.path.join(folder, '.queried.json')
-    json_str = json.dumps(json_entries, sort_keys=True, indent=4, separators=(',', ': '))
+    json_str = utils.json_dumps(json_entries)
     utils.write_with_backup(json_path, json_str, use_backup)
     rejected_path = os.path.join(folder, '.rejected.txt')
     if len(rejected) > 0:
@@ -93,30 +130,40 @@ def query_google_folder(folder, use_backup):
         folder (and backup previous database if it differed).
     """
 
+    # Online providers are slow to import, only load them when needed
+    import providers
+
     # Create database
-    db = utils.read_bib_file(os.path.join(folder, '.queried.bib'))
+    bib_path = os.path.join(folder, '.queried.bib')
+    db = utils.read_bib_file(bib_path)
     files = utils.guess_manual_files(folder, db, update_queried_db=False)
     utils.add_skip_files(folder, files)
 
-    for path in utils.get_pdf_list(folder):
-        file = os.path.basename(path)
-        parsed = nomenclature.parse_filename(file)
-        if parsed is None or file in files:
-            continue
-        print('Q: ' + os.path.basename(file))
-        authors, title = parsed
-
-        # Google Scholar
-        rbib = providers.scholarly_query(authors, title)
-        if rbib is None:
-            continue
+    with utils.query_cache(folder) as cache:
+        for path in utils.get_pdf_list(folder):
+            file = os.path.basename(path)
+            parsed = nomenclature.parse_filename(file)
+            if parsed is None or file in files:
+                continue
+            print('Q: ' + file)
+            authors, title = parsed
+
+            # Google Scholar
+            key = utils.query_cache_key(authors, title)
+            cached = utils.query_cache_get(cache, 'google', key)
+            if cached is None:
+                rbib = providers.scholarly_query(authors, title)
+                utils.query_cache_put(cache, 'google', key, rbib, None, 0)
+            else:
+                rbib = cached[0]
+            if rbib is None:
+                continue
 
-        # Append filename and store entry
-        rbib['file'] = utils.encode_filename_field(file)
-        db.entries.append(rbib)
+            # Append filename and store entry
+            rbib['file'] = utils.encode_filename_field(file)
+            db.entries.append(rbib)
 
     # Store results
-    bib_path = os.path.join(folder, '.queried.bib')
     utils.write_with_backup(bib_path, utils.write_bib(db, order=False), use_backup)
 
 
@@ -129,7 +176,7 @@ def format_folder(folder, use_backup, context=None):
     Args:
         folder (str): absolute or relative path to the folder to process.
         use_backup (bool): whether to backup previous files before writing.
-        context (set): set of existing bibtex keys in the current context.
+        context (dict): bibtex keys generated in the current context (see gen_bibkey).
 
     Returns:
         Nothing, but writes the results in a file called 'biblio.bib'.
@@ -140,7 +187,7 @@ def format_folder(folder, use_backup, context=None):
     utils.guess_manual_files(folder, db, update_queried_db=True)
 
     if context is None:
-        context = set()
+        context = {}
 
     # Generate bibkeys
     for entry in db.entries:
@@ -173,12 +220,19 @@ def rename_folder(folder, use_backup):
     queried_db = utils.read_bib_file(queried_bib_path)
     queried_files = utils.create_file_dict(queried_db)
 
-    # Iterate over db entries
-    need_rename = False
+    # Compute the old and new filename of each entry
+    plan = []
     for entry in pretty_db.entries:
         old_filename = utils.decode_filename_field(entry['file'])
         new_filename = nomenclature.gen_filename(entry)
-        if not os.path.exists(os.path.join(folder, old_filename)):
+        plan.append((entry, old_filename, new_filename))
+
+    # Iterate over db entries (files listed in `.biblist` may live in other folders)
+    with os.scandir(folder) as it:
+        existing = {e.name for e in it}
+    need_rename = False
+    for entry, old_filename, new_filename in plan:
+        if old_filename not in existing and not os.path.exists(os.path.join(folder, old_filename)):
             print(termcolor.colored('file not found: ', 'red') + old_filename)
         elif old_filename != new_filename:
             need_rename = True
@@ -190,20 +244,21 @@ def rename_folder(folder, use_backup):
         return
 
     # Ask confirmation
-    cmd = input('(Y/n) ')
-    if cmd == '' or cmd == 'y' or cmd == 'Y':
-        for entry in pretty_db.entries:
-            old_filename = utils.decode_filename_field(entry['file'])
-            new_filename = nomenclature.gen_filename(entry)
+    if utils.confirm('(Y/n) '):
+        for entry, old_filename, new_filename in plan:
+            if old_filename == new_filename:
+                continue
             old_path = os.path.join(folder, old_filename)
             new_path = os.path.join(folder, new_filename)
-            if os.path.exists(old_path):
+            try:
                 os.rename(old_path, new_path)
-                new_val = utils.encode_filename_field(new_filename)
-                if old_filename in queried_files:
-                    idx = queried_files[old_filename]
-                    queried_db.entries[idx]['file'] = new_val
-                entry['file'] = new_val
+            except FileNotFoundError:
+                continue
+            new_val = utils.encode_filename_field(new_filename)
+            if old_filename in queried_files:
+                idx = queried_files[old_filename]
+                queried_db.entries[idx]['file'] = new_val
+            entry['file'] = new_val
 
     # Write output bibtex files
     utils.write_with_backup(pretty_bib_path, utils.write_bib(pretty_db, order=False), use_backup)
@@ -213,6 +268,8 @@ def rename_folder(folder, use_backup):
 def sync_folder(folder, use_backup):
     """
     Update the file field of bibtex entries for the given folder.
+    Entries are matched to pdf files globally, starting with the most similar
+    pairs, so that each file is assigned to at most one entry.
     When an entry could not find a good match, it will be removed from the
     bibtex, unless the user explicitly prevents it.
 
@@ -223,19 +280,24 @@ def sync_folder(folder, use_backup):
     Returns:
         Nothing, but updates `.queried.bib` and `biblio.bib` files.
     """
+    pdfs = [os.path.basename(f) for f in utils.get_pdf_list(folder)]
     for bib_file in ('.queried.bib', 'biblio.bib'):
         bib_path = os.path.join(folder, bib_file)
         db = utils.read_bib_file(bib_path)
-        unmatched = set([os.path.basename(f) for f in utils.get_pdf_list(folder)])
-        to_delete = []
-        for i, entry in enumerate(db.entries):
-            guess = nomenclature.gen_filename(entry)
+        guesses = []
+        for entry in db.entries:
             if 'file' in entry:
-                guess = utils.decode_filename_field(entry['file'])
-            match, score = utils.most_similar_filename(guess, unmatched)
+                guesses.append(utils.decode_filename_field(entry['file']))
+            else:
+                guesses.append(nomenclature.gen_filename(entry))
+        # Match entries and pdfs globally, starting with the most similar pairs
+        scores = utils.similarity_matrix(guesses, pdfs)
+        matching = utils.greedy_matching(scores)
+        to_delete = []
+        for i, (entry, guess) in enumerate(zip(db.entries, guesses)):
+            score = scores[i][matching[i]] if i in matching else 0.0
             if score >= 0.90:
-                unmatched.remove(match)
-                entry['file'] = utils.encode_filename_field(match)
+                entry['file'] = utils.encode_filename_field(pdfs[matching[i]])
             else:
                 print(termcolor.colored(bib_file, "magenta") +
                       ": ({1}) will remove '{0}'".format(guess, termcolor.colored(score, "yellow")))
@@ -243,8 +305,7 @@ def sync_folder(folder, use_backup):
 
         # Delete unmatched entries
         if to_delete:
-            cmd = input('(Y/n) ')
-            if cmd == '' or cmd == 'y' or cmd == 'Y':
+            if utils.confirm('(Y/n) '):
                 for i in sorted(to_delete, reverse=True):
                     del db.entries[i]
 
@@ -255,8 +316,8 @@ def sync_folder(folder, use_backup):
 def merge_folder_tree(folder, use_backup):
     """
     Merge bib files from the current subtree into a master bib file at the root.
-    This function updates the 'file' link of each entry with the relative path
-    to each subfolder that has been processed.
+    Entries are deduplicated by bibtex key in a single pass, and their 'file'
+    field is removed.
 
     Args:
         folder (str): relative or absolute path of the folder to process.
@@ -264,22 +325,20 @@ def merge_folder_tree(folder, use_backup):
     Returns:
         Nothing, but creates a file named `master.bib` in the given folder.
     """
-    db = BibDatabase()
-    for subdir, _dirs, _files in os.walk(os.path.abspath(folder)):
-        if os.path.exists(os.path.join(subdir, '.nobib')):
-            continue  # Skip blacklisted folders
-        reldir = os.path.relpath(subdir, os.path.abspath(folder))
-        bib_path = os.path.join(subdir, 'biblio.bib')
-        subdb = utils.read_bib_file(bib_path)
+    # Entries are indexed by bibtex key to remove duplicated entries
+    entries = {}
+    root = os.path.abspath(folder)
+    bib_paths = [os.path.join(subdir, 'biblio.bib') for subdir, _entries in utils.walk_bibdirs(root)]
+    # Read the bib files concurrently, but merge them in the order of the walk
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        subdbs = list(executor.map(utils.read_bib_file, bib_paths))
+    for subdb in subdbs:
         for entry in subdb.entries:
-            filename = utils.decode_filename_field(entry['file'])
-            filename = os.path.join(reldir, filename)
-            del entry['file']
-            # entry['file'] = utils.encode_filename_field(filename)
-        db.entries += subdb.entries
-    # Remove duplicated entries
-    entries_dict = db.entries_dict
-    db.entries = [val for key, val in entries_dict.items()]
+            # The 'file' field is not kept in the master bib file
+            entry.pop('file', None)
+            entries[entry['ID']] = entry
+    db = BibDatabase()
+    db.entries = list(entries.values())
     # Write result
     bib_path = os.path.join(folder, 'master.bib')
     utils.write_with_backup(bib_path, utils.write_bib(db, order=True), use_backup)
@@ -288,25 +347,20 @@ def merge_folder_tree(folder, use_backup):
 def clean_folder_tree(folder):
     """
     Removed backup files from the given folder tree.
-    Backup are files that ends with .bak or .bak
+    Backup are files that ends with .bak or .bak.N
 
     Args:
         folder (str): relative or absolute path of the folder to cleanup.
     """
     res = []
-    for subdir, _dirs, files in os.walk(folder):
-        if os.path.exists(os.path.join(subdir, '.nobib')):
-            continue  # Skip blacklisted folders
-        files = [f for f in os.listdir(subdir) if re.search('.*\\.bak([0-9]*)?', f)]
-        res = res + [os.path.join(subdir, f) for f in files]
+    for subdir, entries in utils.walk_bibdirs(folder):
+        res.extend(e.path for e in entries if '.bak' in e.name and BACKUP_RE.search(e.name) and not e.is_dir())
     for path in res:
-        assert os.path.exists(path)
         print("will remove '" + path + "'")
     if len(res) == 0:
         print("nothing to delete")
     else:
-        cmd = input("confirm deletion (y/N) ")
-        if cmd == 'y':
+        if utils.confirm("confirm deletion (y/N) ", default=False):
             for path in res:
                 os.remove(path)
 
@@ -323,7 +377,7 @@ def format_file(filename, use_backup):
     """
     db = utils.read_bib_file(filename, homogenize=True)
     # Generate bibkeys
-    context = set()
+    context = {}
     subst = {}
     for entry in db.entries:
         old_key = entry['ID']
@@ -343,8 +397,7 @@ def extract_from_file(filename, output_folder):
     db = utils.read_bib_file(filename, homogenize=False)
     outfile = os.path.join(output_folder, ".biblist")
     if os.path.exists(outfile):
-        cmd = input("overwrite existing file '{0}' (y/N) ".format(outfile))
-        if cmd != 'y':
+        if not utils.confirm("overwrite existing file '{0}' (y/N) ".format(outfile), default=False):
             return
     filenames = sorted([nomenclature.gen_filename(entry) for entry in db.entries])
     with open(outfile, 'w') as f:
@@ -358,7 +411,8 @@ def remap_keys(old_filename, new_filename, output_folder):
     Create a script to remap bibtex keys from one .bib file to another.
 
     This function uses the edit distance on filenames generated from a bitex entry
-    to compare entries together, and greedily matches old entries to new entries.
+    to compare entries together, and greedily matches old entries to new entries
+    (each old entry being matched at most once).
     """
     old_db = utils.read_bib_file(old_filename, homogenize=False)
     new_db = utils.read_bib_file(new_filename, homogenize=False)
@@ -375,23 +429,51 @@ def remap_keys(old_filename, new_filename, output_folder):
             del new_list[name]
         else:
             old_list[name] = entry['ID']
-    for name, bibkey in new_list.items():
-        match, score = utils.most_similar_filename(name, old_list.keys())
-        if score < 0.90:
+    # Greedily match the remaining entries, starting with the most similar pairs
+    new_names = list(new_list.keys())
+    old_names = list(old_list.keys())
+    scores = utils.similarity_matrix(new_names, old_names)
+    matching = utils.greedy_matching(scores)
+    for i, j in matching.items():
+        name, match = new_names[i], old_names[j]
+        if scores[i][j] < 0.90:
             print(termcolor.colored("Warning: potentially incorrect substitution:", 'yellow', attrs=["bold"]))
             print(termcolor.colored('-', 'red') + match)
             print(termcolor.colored('+', 'green') + name)
-        subst[old_list[match]] = bibkey
+        subst[old_list[match]] = new_list[name]
+    for i, name in enumerate(new_names):
+        if i not in matching:
+            print(termcolor.colored("Warning: no entry to substitute with:", 'yellow', attrs=["bold"]))
+            print(termcolor.colored('+', 'green') + name)
     utils.write_remap_script(subst, output_folder)
 
 
-def apply_folder_tree(folder, func, *args):
-    for subdir, _dirs, _files in os.walk(folder):
-        if os.path.exists(os.path.join(subdir, '.nobib')):
-            continue  # Skip blacklisted folders
-        if utils.has_pdfs(subdir):
-            print(termcolor.colored('Entering: ' + subdir, "cyan", attrs=["bold"]))
-            func(subdir, *args)
+def apply_folder_tree(folder, func, *args, jobs=1):
+    """
+    Apply a function to each folder containing pdfs in the given folder tree.
+
+    Args:
+        folder (str): relative or absolute path of the root folder.
+        func (callable): function to call as func(subdir, *args).
+        jobs (int): number of folders to process concurrently. Only use more than
+            one job for functions which do not ask for user input and do not share
+            state between folders.
+    """
+    subdirs = []
+    for subdir, entries in utils.walk_bibdirs(folder):
+        if utils.has_pdfs(subdir, entries):
+            subdirs.append(subdir)
+
+    def process_subdir(subdir):
+        print(termcolor.colored('Entering: ' + subdir, "cyan", attrs=["bold"]))
+        func(subdir, *args)
+
+    if jobs > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(process_subdir, subdirs))
+    else:
+        for subdir in subdirs:
+            process_subdir(subdir)
 
 
 def parse_args():
@@ -422,6 +504,10 @@ def parse_args():
                         help="extract pdfs names from bibtex")
     parser.add_argument('-k', '--compare', default="",
                         help="create a script to remap bibtex entries from one .bib to another")
+    parser.add_argument('-y', '--assume-yes', default=False, action='store_true',
+                        help="automatically answer yes to all prompts")
+    parser.add_argument('-j', '--jobs', default=1, type=int,
+                        help="number of folders to query concurrently (requires --assume-yes)")
     parser.add_argument('-t', '--tol', default=config.crossref_accept_threshold,
                         type=float, help="set crossref tolerance")
     parser.add_argument('-u', '--utf8', default=config.use_utf8_characters, type=ast.literal_eval,
@@ -441,6 +527,7 @@ if __name__ == "__main__":
         # Set config from command line
         config.crossref_accept_threshold = args.tol
         config.use_utf8_characters = bool(args.utf8)
+        config.assume_yes = args.assume_yes
         # If input path is a bib file
         if input_path.endswith('.bib'):
             assert os.path.isfile(input_path)
@@ -457,13 +544,18 @@ if __name__ == "__main__":
             assert os.path.isdir(input_path)
             # Crossref query
             if args.crossref:
-                apply_folder_tree(input_path, query_crossref_folder, args.backup)
+                # Matching manual entries may prompt the user, so folders can only be
+                # processed concurrently when all prompts are answered automatically
+                jobs = args.jobs if config.assume_yes else 1
+                if jobs != args.jobs:
+                    print(termcolor.colored('Ignoring --jobs without --assume-yes', 'yellow'))
+                apply_folder_tree(input_path, query_crossref_folder, args.backup, jobs=jobs)
             # Google scholar query
             if args.google:
                 apply_folder_tree(input_path, query_google_folder, args.backup)
             # Format biblio
             if args.format:
-                context = set()
+                context = {}
                 apply_folder_tree(input_path, format_folder, args.backup, context)
             # Sync filenames
             if args.sync:
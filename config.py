@@ -25,8 +25,34 @@ mixedcase_words = [
 # Crossref acceptance threshold
 crossref_accept_threshold = 2.8
 
+# Email address sent along Crossref queries (gives access to the faster "polite" pool)
+crossref_mailto = None
+
+# Maximum number of concurrent Crossref queries
+crossref_max_workers = 8
+
+# Maximum number of requests per second sent to Crossref
+crossref_rate_limit = 50
+
+# Timeout (in seconds) of the requests sent to doi.org to retrieve bibtex entries
+crossref_timeout = 30
+
+# Time (in seconds) after which cached online queries are discarded
+query_cache_ttl = 30 * 24 * 3600
+
+# User-wide cache of the bibtex entries retrieved for each DOI, and of the parsed .bib files (set to None to disable)
+cache_file = '~/.cache/autobib/cache.sqlite'
+
+# Scorer used to compare filenames when rapidfuzz is installed: 'ratio', 'token_sort_ratio' (insensitive
+# to the order of the words) or 'token_set_ratio' (also ignores duplicated words). Without rapidfuzz,
+# filenames are always compared with the 'ratio' of difflib.
+filename_scorer = 'ratio'
+
 # Whether to write accented characters (True), or their latex equivalent (False)
 use_utf8_characters = False
 
 # Protect uppercase words when writing the 'title' field
 protect_uppercase = True
+
+# Automatically answer yes to all prompts
+assume_yes = False
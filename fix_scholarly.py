@@ -36,18 +36,36 @@ _SCHOLARCITERE = r'gs_ocit\(event,\'([\w-]*)\''
 _SESSION = requests.Session()
 _PAGESIZE = 100
 
+# Delay between two requests, increased when Google answers with a captcha
+_MIN_DELAY = 1.0
+_MAX_DELAY = 10.0
+_DELAY = _MIN_DELAY
+_LAST_REQUEST = 0.0
+
+
+def _throttle():
+    """Wait until the current delay has elapsed since the previous request"""
+    global _LAST_REQUEST
+    wait = _LAST_REQUEST + _DELAY * random.uniform(1, 1.5) - time.monotonic()
+    if wait > 0:
+        time.sleep(wait)
+    _LAST_REQUEST = time.monotonic()
+
 
 def _get_page(pagerequest):
     """Return the data for a page on scholar.google.com"""
+    global _DELAY
     # Note that we include a sleep to avoid overloading the scholar server
-    time.sleep(5 + random.uniform(0, 5))
+    _throttle()
     # Deal with local / absolute url requests
     if pagerequest.startswith('/'):
         pagerequest = _SCHOLARHOST + pagerequest
     resp_url = _SESSION.get(pagerequest, headers=_HEADERS, cookies=_COOKIES)
     if resp_url.status_code == 200:
+        _DELAY = max(_MIN_DELAY, _DELAY / 2)
         return resp_url.text
     if resp_url.status_code == 503:
+        _DELAY = min(_MAX_DELAY, _DELAY * 2)
         # Inelegant way of dealing with the G captcha
         dest_url = requests.utils.quote(pagerequest)
         g_id_soup = BeautifulSoup(resp_url.text, 'html.parser')
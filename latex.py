@@ -3,6 +3,7 @@
 
 # System libs
 import re
+import functools
 import unicodedata
 
 # Third party libs
@@ -18,6 +19,10 @@ accents = {
     0x030A: 'r', 0x0306: 'u', 0x030C: 'v',
 }
 
+NESTED_BRACES_RE = re.compile('{{([^{}]*)}}')
+SINGLE_CHAR_BRACES_RE = re.compile('{([^{}])}')
+LETTERS_BRACES_RE = re.compile('{([a-zA-Z]*)}')
+
 specials = {
     'ø': '\\o',
     'ß': '\\ss',
@@ -25,58 +30,87 @@ specials = {
 }
 
 
+def precomposed2tex(char):
+    """
+    Translate a single (non-combining) unicode character into a latex macro,
+    or return it unchanged if there is no known translation.
+    """
+    decomposition = unicodedata.decomposition(char).split()
+    # precomposed characters
+    if len(decomposition) == 2 and not decomposition[0].startswith('<'):
+        base, acc = (int(x, 16) for x in decomposition)
+        if acc in accents:
+            return "{\\%s{%s}}" % (accents[acc], chr(base))
+        return char
+    # other special case
+    elif char in specials:
+        return "{%s}" % specials[char]
+    return char
+
+
+# Translation table of the characters preceding the combining diacritical marks
+# block (U+0300), which can be translated independently of their neighbors
+translation_table = {code: precomposed2tex(chr(code)) for code in range(0x80, 0x300)}
+
+
+@functools.lru_cache(maxsize=8192)
 def uni2tex(text):
     """
     Translate accented unicode characters intro latex macros.
 
     http://tex.stackexchange.com/questions/23410/how-to-convert-characters-to-latex-code
     """
-    out = ""
-    txt = tuple(text)
+    if text.isascii():
+        return text
+    if max(text) < '\u0300':
+        return text.translate(translation_table)
+
+    out = []
     i = 0
-    while i < len(txt):
+    while i < len(text):
         char = text[i]
         code = ord(char)
 
         # combining marks
         if unicodedata.category(char) in ("Mn", "Mc") and code in accents:
-            out += "{\\%s{%s}}" % (accents[code], txt[i + 1])
+            out.append("{\\%s{%s}}" % (accents[code], text[i + 1]))
             i += 1
-        # precomposed characters
-        elif unicodedata.decomposition(char):
-            base, acc = unicodedata.decomposition(char).split()
-            acc = int(acc, 16)
-            base = int(base, 16)
-            if acc in accents:
-                out += "{\\%s{%s}}" % (accents[acc], chr(base))
-            else:
-                out += char
-        # other special case
-        elif char in specials:
-            out += "{%s}" % specials[char]
         else:
-            out += char
+            out.append(precomposed2tex(char))
 
         i += 1
 
-    return out
+    return ''.join(out)
 
 
 def remove_nested_braces(s):
     """
     Remove some cases of nested braces such as 'a{{b}}c' -> 'a{b}c'.
     """
-    for __ in range(10):
-        x = re.sub('{{([^{}]*)}}', '{\\1}', s)
-        if len(x) >= len(s):
-            break
-        else:
-            s = x
-    s = re.sub('{([^{}])}', '\\1', s)
-    s = re.sub('{([a-zA-Z]*)}', '\\1', s)
+    count = 1
+    while count > 0:
+        s, count = NESTED_BRACES_RE.subn('{\\1}', s)
+    s = SINGLE_CHAR_BRACES_RE.sub('\\1', s)
+    s = LETTERS_BRACES_RE.sub('\\1', s)
     return s
 
 
+def has_balanced_braces(s):
+    """
+    Check whether the curly braces of a latex string are balanced.
+    """
+    depth = 0
+    for c in s:
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0
+
+
+@functools.lru_cache(maxsize=8192)
 def protect_uppercase(s):
     """
     Protect uppercase words defined in config.py
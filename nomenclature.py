@@ -4,8 +4,8 @@
 # System libs
 import re
 import os
-import json
 import codecs
+import functools
 
 # Third party libs
 import titlecase
@@ -18,7 +18,27 @@ import config
 import utils
 import latex
 
-
+# Regular expressions used to parse and generate filenames
+SUPPLEMENTAL_RE = re.compile('supplement[a-z]*( material)?(\\))?.pdf', re.IGNORECASE)
+CHANGES_RE = re.compile(' - changes.pdf', re.IGNORECASE)
+AUTHORS_TITLE_RE = re.compile('\\((.*?)( et al.)?\\) (.*).pdf')
+TITLE_RE = re.compile('(.*).pdf')
+COLON_RE = re.compile(' *: ')
+EMDASH_RE = re.compile(' *— *')
+NON_ALPHA_RE = re.compile('([^a-zA-Z])')
+AMPERSAND_RE = re.compile('\\\\?&')
+# Strings without any of these patterns are left unchanged by the latex codec
+LATEX_MARKUP_RE = re.compile("[\\\\%~`$\\n]|''|,,|--|[ \\t]{2}|^[ \\t]")
+
+# Single character substitutions, applied in one pass with str.translate
+STRIP_NAME = str.maketrans({'{': None, '}': None, '~': ' '})
+ASCII_NAME = str.maketrans({'ı': 'i', 'ø': 'o', 'ł': 'l'})
+STRIP_TITLE = str.maketrans({'{': None, '}': None, '–': '-', '/': '-'})
+ASCII_TITLE = str.maketrans({'"': None, '’': "'", '\u2010': '-', '\u2122': None})
+NEWLINES = str.maketrans({'\n': ' ', '\r': None})
+
+
+@functools.lru_cache(maxsize=8192)
 def to_titlecase(text):
     """
     Converts string into a titlecased version of itself.
@@ -43,6 +63,37 @@ def to_titlecase(text):
     return titlecase.titlecase(text, callback=abbreviations)
 
 
+@functools.lru_cache(maxsize=8192)
+def parse_authors(author):
+    """
+    Split the content of an author field into a list of "Last, First" names.
+
+    Args:
+        author (str): content of the author field of a bibtex entry.
+
+    Returns:
+        A tuple of author names.
+    """
+    record = bibtexparser.customization.author({'author': author})
+    return tuple(record.get('author', ()))
+
+
+@functools.lru_cache(maxsize=8192)
+def latex_to_ascii(text):
+    """
+    Decode the latex macros of a string, and strip the accents of the result.
+
+    Args:
+        text (str): latex string to decode.
+
+    Returns:
+        The decoded string, without accents.
+    """
+    if LATEX_MARKUP_RE.search(text):
+        text = codecs.decode(text, "ulatex")
+    return utils.strip_accents(text)
+
+
 def parse_filename(path):
     """
     Extract author list and article title from a well-formed filename.
@@ -57,14 +108,14 @@ def parse_filename(path):
         None if the file should not be processed.
     """
     file = os.path.basename(path)
-    if re.search('supplement[a-z]*( material)?(\\))?.pdf', file, re.IGNORECASE):
+    if SUPPLEMENTAL_RE.search(file):
         return None  # Don't process supplementals
-    if re.search(' - changes.pdf', file, re.IGNORECASE):
+    if CHANGES_RE.search(file):
         return None  # Another ignored file
     assert file.endswith(".pdf")
-    match = re.search('\\((.*?)( et al.)?\\) (.*).pdf', file)
+    match = AUTHORS_TITLE_RE.search(file)
     if not match:
-        match = re.search('(.*).pdf', file)
+        match = TITLE_RE.search(file)
         assert match, "Error parsing filename: " + file
         authors = ""
         title = match.group(1)
@@ -84,21 +135,30 @@ def gen_filename(record):
     Returns:
         A string which corresponds to guessed filename (expected to be a pdf).
     """
-    record_copy = record.copy()
-    record_copy = bibtexparser.customization.author(record_copy)
+    return format_filename(record['author'], utils.get_title(record))
+
 
+@functools.lru_cache(maxsize=4096)
+def format_filename(authors, title):
+    """
+    Format the expected filename from the author and title fields of a record.
+
+    Args:
+        authors (str): author field of the bibtex entry.
+        title (str): title of the bibtex entry (see utils.get_title).
+
+    Returns:
+        A string which corresponds to guessed filename (expected to be a pdf).
+    """
     # Retrieve a stripped down last name of the first authors
     last_names = []
-    for author in record_copy['author']:
-        stripped = utils.strip_accents(codecs.decode(author, "ulatex"))
-        name = re.sub('([\\{\\}])', '', stripped.split(',')[0])
-        name = re.sub('~', ' ', name)
-        name = re.sub("\\\\'ı", "i", name)
-        name = re.sub("\\\\`ı", "i", name)
-        name = re.sub("ı", "i", name)
-        name = re.sub('\xf8', 'o', name)
-        name = re.sub('\\\\textquotesingle ', "'", name)
-        name = name.replace('ł', 'l')
+    for author in parse_authors(authors):
+        stripped = latex_to_ascii(author)
+        name = stripped.split(',')[0].translate(STRIP_NAME)
+        name = name.replace("\\'ı", "i")
+        name = name.replace("\\`ı", "i")
+        name = name.replace('\\textquotesingle ', "'")
+        name = name.translate(ASCII_NAME)
         last_names.append(name)
 
     # If there are more than 4 authors, use the 'et al.' form
@@ -107,22 +167,16 @@ def gen_filename(record):
     else:
         prefix = '(' + ', '.join(last_names) + ') '
 
-    title = utils.get_title(record_copy)
     title = title.replace('$\\Lambda_{훜fty}$ ', 'λ∞')
-    title = re.sub('\\\\textendash  ', '- ', title)
-    title = utils.strip_accents(codecs.decode(title, "ulatex"))
-    title = re.sub('([\\{\\}])', '', title)
-    title = re.sub(' *: ', ' - ', title)
-    title = re.sub(' *— *', ' - ', title)
-    title = re.sub('–', '-', title)
-    title = re.sub('/', '-', title)
+    title = title.replace('\\textendash  ', '- ')
+    title = latex_to_ascii(title)
+    title = title.translate(STRIP_TITLE)
+    title = COLON_RE.sub(' - ', title)
+    title = EMDASH_RE.sub(' - ', title)
     # title = re.sub('\\$\\mathplus \\$', '+', title)
-    title = re.sub('\\\\textquotesingle ', "'", title)
+    title = title.replace('\\textquotesingle ', "'")
     title = to_titlecase(title)
-    title = re.sub('"', '', title)
-    title = re.sub('’', "'", title)
-    title = re.sub('\u2010', '-', title)
-    title = re.sub('\u2122', '', title)
+    title = title.translate(ASCII_TITLE)
     title = title.replace('$\\texttt FreeFem++$', 'FreeFem++')
     title = title.replace('$\\lambda _\\Infty $ ', 'λ∞')
 
@@ -135,46 +189,43 @@ def gen_bibkey(record, all_keys):
 
     Args:
         record (dict): a record of the bibtex entry.
-        all_keys (set): a set of existing bibtex keys in the current context.
+        all_keys (dict): number of bibtex keys generated so far for each base key
+            (Author:Year:Initials) in the current context.
 
     Returns:
         A string which corresponds to the newly generated unique bibtex key.
-        The argument 'all_keys' is also appended with the new key.
+        The argument 'all_keys' is also updated with the new key.
     """
     for field in ['year', 'title', 'author']:
         if field not in record:
-            record_str = json.dumps(record, sort_keys=True, indent=4, separators=(',', ': '))
+            record_str = utils.json_dumps(record)
             raise ValueError("Missing field '{0}' in bibtex entry:\n{1}".format(field, record_str))
 
-    record_copy = record.copy()
-    record_copy = bibtexparser.customization.author(record_copy)
-
     # Retrieve a stripped down last name of the first author
-    first_author = record_copy['author'][0]
-    stripped = utils.strip_accents(codecs.decode(first_author, "ulatex"))
+    first_author = parse_authors(record['author'])[0]
+    stripped = latex_to_ascii(first_author)
     last_name = stripped.split(',')[0]
     last_name = last_name.replace('ø', 'o')
     last_name = last_name.replace('ł', 'l')
-    last_name = re.sub('([^a-zA-Z])', '', last_name)
+    last_name = NON_ALPHA_RE.sub('', last_name)
 
     # Then get the first 3 initials of the article title
-    curated_title = re.sub('([^a-zA-Z])', ' ', utils.get_title(record_copy))
+    curated_title = NON_ALPHA_RE.sub(' ', utils.get_title(record))
     short_title = ''.join(s[0] for s in curated_title.split())
     short_title += curated_title.split()[-1][1:]
     short_title = short_title[:3].upper()
 
     # Key is Author:Year:Initials
-    basekey = last_name + ":" + record_copy['year'] + ":" + short_title
-    bibkey = basekey
-
-    # Assign a unique key
-    tail = 'a'
-    while bibkey in all_keys:
-        bibkey = basekey + tail
-        tail = chr((ord(tail) + 1))
+    basekey = last_name + ":" + record['year'] + ":" + short_title
 
-    all_keys.add(bibkey)
-    return bibkey
+    # Assign a unique key (subsequent keys are suffixed with a, b, ..., z, aa, ab, ...)
+    count = all_keys.get(basekey, 0)
+    all_keys[basekey] = count + 1
+    suffix = ''
+    while count > 0:
+        count, rem = divmod(count - 1, 26)
+        suffix = chr(ord('a') + rem) + suffix
+    return basekey + suffix
 
 
 def homogenize_latex_encoding(record):
@@ -205,15 +256,15 @@ def homogenize_latex_encoding(record):
             # record[val] = bibtexparser.latexenc.string_to_latex(record[val])
             if '{' in record[val]:
                 record[val] = latex.remove_nested_braces(record[val])
-            record[val] = re.sub('\\\\?&', '\\&', record[val])
+            record[val] = AMPERSAND_RE.sub('\\&', record[val])
             record[val] = record[val].replace('\\i', 'i')
-            record[val] = record[val].replace('\n', ' ').replace('\r', '')
-            record[val] = re.sub('\\\\textdollar \\\\textbackslash mathplus\\\\textdollar ', '+', record[val])
-            record[val] = re.sub('\\$\\\\mathplus\\$', '+', record[val])
-            record[val] = re.sub('\{́i\}', 'í', record[val])
+            record[val] = record[val].translate(NEWLINES)
+            record[val] = record[val].replace('\\textdollar \\textbackslash mathplus\\textdollar ', '+')
+            record[val] = record[val].replace('$\\mathplus$', '+')
+            record[val] = record[val].replace('{́i}', 'í')
             if val == 'title':
-                record[val] = re.sub('GCMMA-two', 'GCMMA - two', record[val])
-                record[val] = re.sub('ShapeOp—A', 'ShapeOp — A', record[val])
+                record[val] = record[val].replace('GCMMA-two', 'GCMMA - two')
+                record[val] = record[val].replace('ShapeOp—A', 'ShapeOp — A')
                 record[val] = record[val].replace('\\tt{', '\\texttt{')
                 record[val] = record[val].replace('훜fty', '\\infty')
                 record[val] = to_titlecase(record[val])
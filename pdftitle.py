@@ -1,11 +1,11 @@
-#!/usr/bin/env python2.7
+#!/usr/bin/env python3
 # https://gist.github.com/nevesnunes/84b2eb7a2cf63cdecd170c139327f0d6
 
 """
 Extract title from PDF file.
 
 Dependencies:
-    pip install --user unidecode pyPDF PDFMiner
+    pip install --user unidecode 'PyPDF2>=2.0' 'pdfminer.six>=20200402'
 
 Usage:
     find . -name "*.pdf" | xargs -I{} pdftitle -d tmp --rename {}
@@ -19,6 +19,7 @@ Limitations:
     false positives.
 """
 
+import concurrent.futures
 import getopt
 import os
 import re
@@ -27,7 +28,7 @@ import subprocess
 import sys
 import unidecode
 
-from pyPdf import PdfFileReader
+from PyPDF2 import PdfReader
 from pdfminer.pdfdocument import PDFDocument
 from pdfminer.pdfpage import PDFPage
 from pdfminer.pdfparser import PDFParser
@@ -51,6 +52,22 @@ MIN_CHARS = 6
 MAX_WORDS = 20
 MAX_CHARS = MAX_WORDS * 10
 TOLERANCE = 1e-06
+# Only consider the upper part of the first page when looking for the title
+TITLE_AREA = 0.5
+
+# Placeholder text or copyright information
+JUNK_RE = re.compile(r'^[0-9 \t-]+(abstract|introduction)?\s+$|^(abstract|unknown|title|untitled):?$|'
+                     r'paper\s+title|technical\s+report|proceedings|preprint|to\s+appear|submission|(integrated|international).*conference|transactions\s+on|symposium\s+on|downloaded\s+from\s+http')
+PDF_EXTENSION_RE = re.compile(r'\.pdf(\.pdf)*$')
+BLANKS_RE = re.compile(r'[ \t][ \t]*')
+WHITESPACE_RE = re.compile(r'[ \t\n]')
+TRAILING_NEWLINE_RE = re.compile(r'\n$')
+CID_RE = re.compile(r'(\(cid:[0-9 \t-]*\))*')
+VALID_CHARS = "-_.() %s%s" % (string.ascii_letters, string.digits)
+STRIP_WHITESPACE = str.maketrans('', '', ' \t\n')
+STRIP_ASCII_LETTERS = str.maketrans('', '', string.ascii_letters)
+STRIP_DOTS_WHITESPACE = str.maketrans('', '', '.\t\n')
+INVALID_CHARS_RE = re.compile('[^%s]' % re.escape(VALID_CHARS))
 
 def sanitize(filename):
     """Turn string into a valid file name.
@@ -69,39 +86,42 @@ def sanitize(filename):
         print("*** Skipping invalid title decoding for file %s! ***" % filename)
 
     # Preserve subtitle and itemization separators
-    filename = re.sub(r',', ' ', filename)
-    filename = re.sub(r': ', ' - ', filename)
+    filename = filename.replace(',', ' ')
+    filename = filename.replace(': ', ' - ')
 
     # Strip repetitions
-    filename = re.sub(r'\.pdf(\.pdf)*$', '', filename)
-    filename = re.sub(r'[ \t][ \t]*', ' ', filename)
+    filename = PDF_EXTENSION_RE.sub('', filename)
+    filename = BLANKS_RE.sub(' ', filename)
 
-    valid_chars = "-_.() %s%s" % (string.ascii_letters, string.digits)
-    return ''.join([c for c in filename if c in valid_chars])
+    return INVALID_CHARS_RE.sub('', filename)
 
 def meta_title(filename):
     """Title from pdf metadata.
     """
-    docinfo = PdfFileReader(file(filename, 'rb')).getDocumentInfo()
-    if docinfo is None:
-        return ''
-    return docinfo.title if docinfo.title else ''
+    # The reader seeks to the trailer and only reads the objects it needs
+    with open(filename, 'rb') as f:
+        docinfo = PdfReader(f).metadata
+        if docinfo is None:
+            return ''
+        return docinfo.title if docinfo.title else ''
 
 def junk_line(line):
     """Judge if a line is not appropriate for a title.
     """
-    too_small = len(line.strip()) < MIN_CHARS
-    is_placeholder_text = bool(re.search(r'^[0-9 \t-]+(abstract|introduction)?\s+$|^(abstract|unknown|title|untitled):?$', line.strip().lower()))
-    is_copyright_info = bool(re.search(r'paper\s+title|technical\s+report|proceedings|preprint|to\s+appear|submission|(integrated|international).*conference|transactions\s+on|symposium\s+on|downloaded\s+from\s+http', line.lower()))
+    stripped = line.strip()
+    too_small = len(stripped) < MIN_CHARS
+    if too_small:
+        return True
+    is_placeholder_or_copyright = bool(JUNK_RE.search(stripped.lower()))
+    if is_placeholder_or_copyright:
+        return True
 
     # NOTE: Titles which only contain a number will be discarded
-    stripped_to_ascii = ''.join([c for c in line.strip() if c in string.ascii_letters])
-    ascii_length = len(stripped_to_ascii)
-    stripped_to_chars = re.sub(r'[ \t\n]', '', line.strip())
-    chars_length = len(stripped_to_chars)
+    ascii_length = len(stripped) - len(stripped.translate(STRIP_ASCII_LETTERS))
+    chars_length = len(stripped.translate(STRIP_WHITESPACE))
     is_serial_number = ascii_length < chars_length / 2
 
-    return too_small or is_placeholder_text or is_copyright_info or is_serial_number
+    return is_serial_number
 
 def empty_str(s):
     return len(s.strip()) == 0
@@ -110,26 +130,34 @@ def is_close(a, b, relative_tolerance=TOLERANCE):
     return abs(a-b) <= relative_tolerance * max(abs(a), abs(b))
 
 def update_largest_text(line, y0, size, largest_text):
-    log('update size: ' + str(size))
-    log('largest_text size: ' + str(largest_text['size']))
+    if IS_LOG_ON:
+        log('update size: ' + str(size))
+        log('largest_text size: ' + str(largest_text['size']))
 
     # Sometimes font size is not correctly read, so we
     # fallback to text y0 (not even height may be calculated).
     # In this case, we consider the first line of text to be a title.
-    if ((size == largest_text['size'] == 0) and (y0 - largest_text['y0'] < -TOLERANCE)):
+    largest_size = largest_text['size']
+    if ((size == largest_size == 0) and (y0 - largest_text['y0'] < -TOLERANCE)):
+        return largest_text
+
+    # Lines smaller than the current largest text are discarded
+    is_larger = size - largest_size > TOLERANCE
+    if not is_larger and not is_close(size, largest_size):
         return largest_text
 
     # If it is a split line, it may contain a new line at the end
-    line = re.sub(r'\n$', ' ', line)
+    if line.endswith('\n'):
+        line = TRAILING_NEWLINE_RE.sub(' ', line)
 
-    if (size - largest_text['size'] > TOLERANCE):
+    if is_larger:
         largest_text = {
             'contents': line,
             'y0': y0,
             'size': size
         }
     # Title spans multiple lines
-    elif is_close(size, largest_text['size']):
+    else:
         largest_text['contents'] = largest_text['contents'] + line
         largest_text['y0'] = y0
 
@@ -141,14 +169,16 @@ def extract_largest_text(obj, largest_text):
     # Also skip other elements such as `LTAnno`.
     for i, child in enumerate(obj):
         if isinstance(child, LTTextLine):
-            log('lt_obj child line: ' + str(child))
+            if IS_LOG_ON:
+                log('lt_obj child line: ' + str(child))
             for j, child2 in enumerate(child):
                 if j > 1 and isinstance(child2, LTChar):
                     largest_text = update_largest_text(child.get_text(), child2.y0, child2.size, largest_text)
                     # Only need to parse size of one char
                     break
         elif i > 1 and isinstance(child, LTChar):
-            log('lt_obj child char: ' + str(child))
+            if IS_LOG_ON:
+                log('lt_obj child char: ' + str(child))
             largest_text = update_largest_text(obj.get_text(), child.y0, child.size, largest_text)
             # Only need to parse size of one char
             break
@@ -161,32 +191,32 @@ def extract_figure_text(lt_obj, largest_text):
     Since text is encoded in `LTChar` elements, we detect separate lines
     by keeping track of changes in font size.
     """
-    text = ''
-    line = ''
+    text = []
+    line = []
     y0 = 0
     size = 0
     char_distance = 0
     char_previous_x1 = 0
     state = CHAR_PARSING_STATE.INIT_X
-    for child in lt_obj:
-        log('child: ' + str(child))
-
-        # Ignore other elements
-        if not isinstance (child, LTChar):
-            continue
-
+    # Ignore other elements
+    chars = [child for child in lt_obj if isinstance(child, LTChar)]
+    for child in chars:
         char_y0 = child.y0
         char_size = child.size
         char_text = child.get_text()
-        decoded_char_text = unidecode.unidecode(char_text.encode('utf-8').decode('utf-8'))
-        log('char: ' + str(char_size) + ' ' + str(decoded_char_text))
+        if IS_LOG_ON:
+            log('child: ' + str(child))
+            decoded_char_text = unidecode.unidecode(char_text.encode('utf-8').decode('utf-8'))
+            log('char: ' + str(char_size) + ' ' + str(decoded_char_text))
 
         # A new line was detected
         if char_size != size:
-            log('new line')
-            largest_text = update_largest_text(line, y0, size, largest_text)
-            text += line + '\n'
-            line = char_text
+            if IS_LOG_ON:
+                log('new line')
+            line_text = ''.join(line)
+            largest_text = update_largest_text(line_text, y0, size, largest_text)
+            text.append(line_text + '\n')
+            line = [char_text]
             y0 = char_y0
             size = char_size
 
@@ -198,9 +228,10 @@ def extract_figure_text(lt_obj, largest_text):
             # NOTE: A word starting with lowercase can't be
             # distinguished from the current word.
             char_current_distance = abs(child.x0 - char_previous_x1)
-            log('char_current_distance: ' + str(char_current_distance))
-            log('char_distance: ' + str(char_distance))
-            log('state: ' + str(state))
+            if IS_LOG_ON:
+                log('char_current_distance: ' + str(char_current_distance))
+                log('char_distance: ' + str(char_distance))
+                log('state: ' + str(state))
 
             # Initialization
             if state == CHAR_PARSING_STATE.INIT_X:
@@ -215,16 +246,18 @@ def extract_figure_text(lt_obj, largest_text):
                 state = CHAR_PARSING_STATE.INSIDE_WORD
             # If the x-position decreased, then it's a new line
             if (state == CHAR_PARSING_STATE.INSIDE_WORD) and (child.x1 < char_previous_x1):
-                log('x-position decreased')
-                line += ' '
+                if IS_LOG_ON:
+                    log('x-position decreased')
+                line.append(' ')
                 char_previous_x1 = child.x1
                 state = CHAR_PARSING_STATE.INIT_D
             # Large enough distance: it's a space
             elif (state == CHAR_PARSING_STATE.INSIDE_WORD) and (char_current_distance > char_distance * 8.5):
-                log('space detected')
-                log('char_current_distance: ' + str(char_current_distance))
-                log('char_distance: ' + str(char_distance))
-                line += ' '
+                if IS_LOG_ON:
+                    log('space detected')
+                    log('char_current_distance: ' + str(char_current_distance))
+                    log('char_distance: ' + str(char_distance))
+                line.append(' ')
                 char_previous_x1 = child.x1
             # When larger distance is detected between chars, use it to
             # improve our heuristic
@@ -234,18 +267,23 @@ def extract_figure_text(lt_obj, largest_text):
             # Chars are sequential
             else:
                 char_previous_x1 = child.x1
-            child_text = child.get_text()
-            if not empty_str(child_text):
-                line += child_text
-    return (largest_text, text)
+            if not empty_str(char_text):
+                line.append(char_text)
+    return (largest_text, ''.join(text))
 
 def pdf_text(filename):
-    fp = open(filename, 'rb')
+    with open(filename, 'rb') as fp:
+        return pdf_text_from_file(fp)
+
+def pdf_text_from_file(fp):
     parser = PDFParser(fp)
     doc = PDFDocument(parser, '')
     parser.set_document(doc)
     rsrcmgr = PDFResourceManager()
-    laparams = LAParams()
+    # Text boxes are only used to find the largest text, so skip the (costly)
+    # hierarchical grouping of boxes done by the layout analysis (requires
+    # pdfminer.six >= 20200402, the legacy pdfminer package rejects None).
+    laparams = LAParams(boxes_flow=None)
     device = PDFPageAggregator(rsrcmgr, laparams=laparams)
     interpreter = PDFPageInterpreter(rsrcmgr, device)
 
@@ -258,22 +296,28 @@ def pdf_text(filename):
     for page in PDFPage.create_pages(doc):
         interpreter.process_page(page)
         layout = device.get_result()
+        y_cutoff = layout.bbox[1] + (layout.bbox[3] - layout.bbox[1]) * (1 - TITLE_AREA)
         for lt_obj in layout:
-            log('lt_obj: ' + str(lt_obj))
+            if lt_obj.y1 < y_cutoff:
+                continue
+            if IS_LOG_ON:
+                log('lt_obj: ' + str(lt_obj))
             if isinstance(lt_obj, LTFigure):
                 (largest_text, figure_text) = extract_figure_text(lt_obj, largest_text)
                 text += figure_text
             elif isinstance(lt_obj, (LTTextBox, LTTextLine)):
-                # Ignore body text blocks
-                stripped_to_chars = re.sub(r'[ \t\n]', '', lt_obj.get_text().strip())
-                if (len(stripped_to_chars) > MAX_CHARS * 2):
-                    continue
+                # Ignore body text blocks (short blocks can be accepted without stripping them)
+                lt_text = lt_obj.get_text()
+                if len(lt_text) > MAX_CHARS * 2:
+                    stripped_to_chars = WHITESPACE_RE.sub('', lt_text.strip())
+                    if (len(stripped_to_chars) > MAX_CHARS * 2):
+                        continue
 
                 largest_text = extract_largest_text(lt_obj, largest_text)
-                text += lt_obj.get_text() + '\n'
+                text += lt_text + '\n'
 
         # Remove unprocessed CID text
-        largest_text['contents'] = re.sub(r'(\(cid:[0-9 \t-]*\))*', '', largest_text['contents'])
+        largest_text['contents'] = CID_RE.sub('', largest_text['contents'])
 
         # Only parse the first page
         return (largest_text, text)
@@ -303,34 +347,28 @@ def text_title(filename):
     else:
         text = largest_text['contents'].strip()
 
-    # Strip dots, which conflict with os.path's splittext()
-    text = re.sub(r'\.', '', text)
-
-    # Strip extra whitespace
-    text = re.sub(r'[\t\n]', '', text)
+    # Strip dots, which conflict with os.path's splittext(), and extra whitespace
+    text = text.translate(STRIP_DOTS_WHITESPACE)
 
     return text
 
 def pdftotext_title(filename):
     """Extract title using `pdftotext`
     """
-    command = 'pdftotext {} -'.format(re.sub(' ', '\\ ', filename))
-    process = subprocess.Popen([command], \
-            shell=True, \
+    # Only the first page is converted, and no shell is involved
+    command = ['pdftotext', '-f', '1', '-l', '1', filename, '-']
+    process = subprocess.Popen(command, \
             stdout=subprocess.PIPE, \
             stderr=subprocess.PIPE)
     out, err = process.communicate()
-    lines = out.strip().split('\n')
+    lines = out.decode('utf-8', 'replace').strip().split('\n')
 
     i = title_start(lines)
     j = title_end(lines, i)
     text = ' '.join(line.strip() for line in lines[i:j])
 
-    # Strip dots, which conflict with os.path's splittext()
-    text = re.sub(r'\.', '', text)
-
-    # Strip extra whitespace
-    text = re.sub(r'[\t\n]', '', text)
+    # Strip dots, which conflict with os.path's splittext(), and extra whitespace
+    text = text.translate(STRIP_DOTS_WHITESPACE)
 
     return text
 
@@ -362,12 +400,36 @@ def pdf_title(filename):
 
     return os.path.basename(os.path.splitext(filename)[0])
 
+def pdf_titles(filenames, jobs=1):
+    """Yield (filename, title) pairs, with title None when extraction failed.
+
+    Titles are extracted in a pool of `jobs` processes when jobs > 1.
+    """
+    if jobs <= 1:
+        for filename in filenames:
+            try:
+                yield filename, pdf_title(filename)
+            except Exception as e:
+                print("*** Failed to extract title from %s: %s ***" % (filename, e))
+                yield filename, None
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(pdf_title, filename) for filename in filenames]
+        for filename, future in zip(filenames, futures):
+            try:
+                yield filename, future.result()
+            except Exception as e:
+                print("*** Failed to extract title from %s: %s ***" % (filename, e))
+                yield filename, None
+
 if __name__ == "__main__":
-    opts, args = getopt.getopt(sys.argv[1:], 'nd:', ['dry-run', 'rename'])
+    opts, args = getopt.getopt(sys.argv[1:], 'nd:j:', ['dry-run', 'rename'])
 
     dry_run = False
     rename = False
     target_dir = "."
+    jobs = 1
 
     for opt, arg in opts:
         if opt in ['-n', '--dry-run']:
@@ -376,13 +438,17 @@ if __name__ == "__main__":
             rename = True
         elif opt in ['-d']:
             target_dir = arg
+        elif opt in ['-j']:
+            jobs = int(arg)
 
     if len(args) == 0:
-        print("Usage: %s [-d output] [--dry-run] [--rename] filenames" % sys.argv[0])
+        print("Usage: %s [-d output] [-j jobs] [--dry-run] [--rename] filenames" % sys.argv[0])
         sys.exit(1)
 
-    for filename in args:
-        title = pdf_title(filename)
+    # Titles may be extracted in parallel, files are renamed sequentially
+    for filename, title in pdf_titles(args, jobs):
+        if title is None:
+            continue
         title = sanitize(' '.join(title.split()))
         if rename:
             new_name = os.path.join(target_dir, title + ".pdf")
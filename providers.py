@@ -3,14 +3,18 @@
 
 # System libs
 import re
-import difflib
+import time
+import functools
+import itertools
 import urllib
+import threading
 
 # Third party libs
+import requests
 import termcolor
 import bibtexparser
 import scholarly
-from habanero import Crossref, cn
+from habanero import Crossref
 
 # Local libs
 import config
@@ -19,14 +23,100 @@ import nomenclature
 import fix_scholarly
 
 
-def print_score(sc):
+# Shared Crossref client. Providing an email address routes queries to the
+# "polite" pool of the Crossref API.
+_CROSSREF = Crossref(mailto=config.crossref_mailto, ua_string='autobib')
+
+# Shared http session for the content negotiation requests sent to doi.org, so
+# that connections are kept alive between queries. The pool holds one connection
+# per worker thread (this only matters if crossref_max_workers exceeds the
+# default pool size of requests, which is 10).
+_SESSION = requests.Session()
+_SESSION.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=max(10, config.crossref_max_workers)))
+_SESSION.headers['User-Agent'] = 'autobib'
+if config.crossref_mailto:
+    _SESSION.headers['User-Agent'] += ' (mailto:{0})'.format(config.crossref_mailto)
+
+# Badly encoded characters found in Crossref metadata
+MOJIBAKE = {
+    'Ă¤': 'ä',
+    'Ă': 'Ö',
+    'รถ': 'ö',
+    'Ăź': 'ü',
+    'Ěo': 'ö',
+    'ďż˝': 'ø',
+    'ĂŤ': 'ë',
+}
+MOJIBAKE_RE = utils.replacements_regex(MOJIBAKE)
+
+# Patterns used to clean up titles
+TRAILING_STAR_RE = re.compile('\\*$', re.ASCII)
+LEADING_NUMBER_RE = re.compile('^[0-9]*\\. ', re.ASCII)
+TRAILING_DOTS_RE = re.compile('\\.*$', re.ASCII)
+
+# Time at which the last Crossref request was sent
+_CROSSREF_LOCK = threading.Lock()
+_CROSSREF_LAST_REQUEST = 0.0
+
+
+def crossref_throttle():
+    """
+    Block until a new request can be sent to Crossref without exceeding the
+    rate limit defined in config.py. Safe to call from multiple threads.
+    """
+    global _CROSSREF_LAST_REQUEST
+    with _CROSSREF_LOCK:
+        now = time.monotonic()
+        wait = _CROSSREF_LAST_REQUEST + 1.0 / config.crossref_rate_limit - now
+        if wait > 0:
+            time.sleep(wait)
+        _CROSSREF_LAST_REQUEST = max(now, _CROSSREF_LAST_REQUEST + 1.0 / config.crossref_rate_limit)
+
+
+@functools.lru_cache(maxsize=1024)
+def content_negotiation(doi):
+    """
+    Retrieve the bibtex entry of a given DOI through content negotiation.
+    Results are kept in memory, and stored in the DOI cache on disk, so that a
+    DOI is only resolved once.
+
+    Args:
+        doi (str): the DOI of the article.
+
+    Returns:
+        The bibtex entry as a string.
+    """
+    bib = utils.doi_cache_get(doi)
+    if bib is not None:
+        return bib
+    resp = _SESSION.get('https://doi.org/' + doi, headers={'Accept': 'application/x-bibtex'},
+                        timeout=config.crossref_timeout)
+    resp.raise_for_status()
+    # The response is utf-8 encoded, but does not always declare a charset, in
+    # which case requests would decode it as latin-1
+    bib = resp.content.decode('utf-8', errors='replace')
+    utils.doi_cache_put(doi, bib)
+    return bib
+
+
+def report(text, output=None):
+    """
+    Print a message, or append it to the output list if one is given.
+    """
+    if output is None:
+        print(text)
+    else:
+        output.append(text)
+
+
+def print_score(sc, output=None):
     if sc >= 3:
         color = "green"
     elif sc >= 2:
         color = "yellow"
     else:
         color = "red"
-    print("Score: " + termcolor.colored(sc, color))
+    report("Score: " + termcolor.colored(sc, color), output)
 
 
 def score_type(s):
@@ -50,13 +140,19 @@ def pick_best(title, item1, item2):
     Pick best record among two items with identical scores.
     """
     def compare(x):
-        return difflib.SequenceMatcher(None, title.lower(), x.lower()).ratio()
+        return utils.simratio(title, x)
     if not item1['title']:
         return item2
     elif not item2['title']:
         return item2
-    r1 = compare(item1['title'][0])
-    r2 = compare(item2['title'][0])
+    title1 = item1['title'][0]
+    title2 = item2['title'][0]
+    if title1.lower() == title2.lower():
+        # Same similarity to the query, no need to compute it
+        r1 = r2 = 0
+    else:
+        r1 = compare(title1)
+        r2 = compare(title2)
     if r1 > r2:
         return item1
     elif r2 > r1:
@@ -69,14 +165,15 @@ def pick_best(title, item1, item2):
             return item2
 
 
-def crossref_query(authors, title):
+def crossref_query(authors, title, output=None):
     """
     Query Crossref database.
 
     Args:
         authors (list): a list of strings for up the first authors last names.
         title (str): the title of the article.
-        filename (str): the original path of the file to link to.
+        output (list): if given, messages are appended to this list instead of
+            being printed, so that concurrent queries do not mix their output.
 
     Returns:
         A tuple (bibtex, json, score) where the first element is the data in
@@ -84,7 +181,7 @@ def crossref_query(authors, title):
         data returned in json format, and the third element is the score of the
         match given by Crossref.
     """
-    cr = Crossref()
+    cr = _CROSSREF
     # works?query.title=An+Improved+Adaptive+Constraint+Aggregation+for+Integrated+Layout+and+Topology+Optimization&query.author=Gao+Zhu+Zhang+Zhou&sort=score&rows=1
     # query = ['+' + name + '' for name in authors]
     # query = 'query.title=' + urllib.parse.quote_plus(title) + '&query.author=' + urllib.parse.quote_plus(' '.join(authors)) + '&sort=score&rows=1'
@@ -98,22 +195,21 @@ def crossref_query(authors, title):
         args = dict(
             query=urllib.parse.quote_plus(title),
         )
+    crossref_throttle()
     x = cr.works(sort='score', limit=1, **args)
     # x = cr.works(query=query)
     assert x['status'] == "ok"
 
     # No result found
     if not x['message']['items']:
-        print_score(0)
+        print_score(0, output)
         return (None, [], 0)
 
-    best_item = x['message']['items'][0]
-    # print(json.dumps(best_item, indent=4))
-    for item in x['message']['items']:
-        if item['score'] < best_item['score']:
-            break
-        else:
-            best_item = pick_best(title, best_item, item)
+    # Items are sorted by decreasing score, only the ones tied with the first need to be compared
+    items = x['message']['items']
+    top_score = items[0]['score']
+    tied = itertools.takewhile(lambda item: item['score'] >= top_score, items)
+    best_item = functools.reduce(lambda item1, item2: pick_best(title, item1, item2), tied)
 
     # Retrieve DOI and json item
     doi = best_item['DOI']
@@ -121,32 +217,25 @@ def crossref_query(authors, title):
 
     # If the entry is invalid, return a score of 0
     if 'author' not in res_json or not res_json['title']:
-        print_score(0)
+        print_score(0, output)
         return (None, res_json, 0)
 
     # Retrieve metadata as bibtex entry
-    res_bib = cn.content_negotiation(ids=doi, format="bibentry")
-    res_bib = re.sub('Ă¤', 'ä', res_bib)
-    res_bib = re.sub('Ă', 'Ö', res_bib)
-    res_bib = re.sub('รถ', 'ö', res_bib)
-    res_bib = re.sub('Ăź', 'ü', res_bib)
-    res_bib = re.sub('Ěo', 'ö', res_bib)
-    res_bib = re.sub('ďż˝', 'ø', res_bib)
-    res_bib = re.sub('ĂŤ', 'ë', res_bib)
+    res_bib = content_negotiation(doi)
+    res_bib = utils.multireplace(res_bib, MOJIBAKE, MOJIBAKE_RE)
     db = bibtexparser.loads(res_bib)
     assert len(db.entries) == 1
     res_bib = db.entries[0]
 
-    # If article has subtitle(s), fix bibtex entry
-    subtitles = None
-    if 'subtitle' in res_json:
-        subtitles = [x for x in res_json['subtitle'] if not str.isupper(x)]
+    # If article has subtitle(s), fix bibtex entry (discard subtitles that are all uppercase)
+    subtitles = [x for x in res_json.get('subtitle', ()) if not x.isupper()]
 
     if subtitles:
-        # Discard subtitle that are all uppercase
         title = ' '.join(res_json['title'])
         subtitle = ' '.join(subtitles)
-        if title.lower().startswith(subtitle.lower()) or utils.simratio(title, subtitle) > 0.95:
+        # The similarity ratio cannot exceed 2 * min(len) / (sum of lengths)
+        similar_lengths = 2 * min(len(title), len(subtitle)) > 0.95 * (len(title) + len(subtitle))
+        if title.lower().startswith(subtitle.lower()) or (similar_lengths and utils.simratio(title, subtitle) > 0.95):
             # Don't repeat title if the subtitle is too similar to the title
             new_title = title
         else:
@@ -157,17 +246,15 @@ def crossref_query(authors, title):
         res_bib['title'] = new_title
 
     # Post-process title
-    res_bib['title'] = re.sub('\\*$', '', res_bib['title'])
-    res_bib['title'] = re.sub('^[0-9]*\\. ', '', res_bib['title'])
-    res_bib['title'] = re.sub('\\.*$', '', res_bib['title'])
+    res_bib['title'] = TRAILING_STAR_RE.sub('', res_bib['title'])
+    res_bib['title'] = LEADING_NUMBER_RE.sub('', res_bib['title'])
+    res_bib['title'] = TRAILING_DOTS_RE.sub('', res_bib['title'])
+    res_bib['title'] = utils.compose_accents(res_bib['title'])
+    res_bib['author'] = utils.compose_accents(res_bib['author'])
 
     # If bibtex entry has a 'journal' field, then use the longest alias from the json
-    if 'journal' in res_bib:
-        best = ""
-        for container in res_json['container-title']:
-            if len(container) > len(best):
-                best = container
-        res_bib['journal'] = best
+    if 'journal' in res_bib and res_json.get('container-title'):
+        res_bib['journal'] = max(res_json['container-title'], key=len)
 
     # If entry is missing the year, set score to 0
     score = res_json['score']
@@ -193,12 +280,12 @@ def crossref_query(authors, title):
     # Fix potential ambiguous author entries
     msg = utils.fix_author_field(res_bib, res_json)
 
-    print('C: ' + nomenclature.gen_filename(res_bib))
-    print_score(score)
+    report('C: ' + nomenclature.gen_filename(res_bib), output)
+    print_score(score, output)
 
     # If score is above threshold, display msg from fix_author_field
     if score >= config.crossref_accept_threshold and msg:
-        print(msg)
+        report(msg, output)
 
     # Return database entry
     return (res_bib, res_json, score)
@@ -226,7 +313,10 @@ def scholarly_query(authors, title):
         del res.bib['abstract']
 
     # Post-process title
-    res.bib['title'] = re.sub('\\.*$', '', res.bib['title'])
+    res.bib['title'] = TRAILING_DOTS_RE.sub('', res.bib['title'])
+    res.bib['title'] = utils.compose_accents(res.bib['title'])
+    if 'author' in res.bib:
+        res.bib['author'] = utils.compose_accents(res.bib['author'])
 
     print('S: ' + nomenclature.gen_filename(res.bib))
     return res.bib
@@ -3,11 +3,11 @@
 
 # System libs
 import os
-import glob
 import shutil
 import argparse
 import tempfile
 import subprocess
+import concurrent.futures
 
 # Third party libs
 import colorama
@@ -49,16 +49,16 @@ def shorten_authors(name):
     return ', '.join(name.split(',')[:3])
 
 
-def rename_pdf(filename):
+def pdf_new_name(filename):
     """
-    Rename a pdf file based on title meta-data.
+    Compute the new name of a pdf file based on its title and author meta-data.
 
     Args:
         filename (str): Path of the pdf file to rename
 
+    Returns:
+        The new base name of the file.
     """
-    # Extract pdf title from pdf file
-    print(filename)
     # r = PdfFileReader(filename)
     # info = r.getDocumentInfo()
     # print("pypdf: ", info.author, info.title)
@@ -75,6 +75,22 @@ def rename_pdf(filename):
             new_name += ' '
         new_name += '{}'.format(title.decode())
     new_name += '.pdf'
+    return new_name
+
+
+def rename_pdf(filename, new_name=None):
+    """
+    Rename a pdf file based on title meta-data.
+
+    Args:
+        filename (str): Path of the pdf file to rename
+        new_name (str): New base name of the file, if already computed with pdf_new_name
+
+    """
+    # Extract pdf title from pdf file
+    print(filename)
+    if new_name is None:
+        new_name = pdf_new_name(filename)
     root_folder = os.path.dirname(filename)
     base_name = os.path.basename(filename)
     if new_name == base_name:
@@ -91,9 +107,31 @@ def rename_pdf(filename):
     #     print('-- New name not valid: {}'.format(new_name))
 
 
-def iterate_folder(path, function):
-    for filename in glob.glob(os.path.join(path, '*.pdf')):
-        function(filename)
+def iterate_folder(path, function, apply=None, jobs=1):
+    """
+    Process the pdf files of a folder.
+
+    Args:
+        path (str): Path of the folder to process
+        function (callable): Function called on each pdf, in worker processes if jobs > 1
+        apply (callable): If given, apply(filename, result) is then called on the
+            result of function for each pdf, sequentially in the main process
+        jobs (int): Number of worker processes
+
+    """
+    with os.scandir(path) as it:
+        filenames = [e.path for e in it if e.name.endswith('.pdf') and not e.name.startswith('.') and e.is_file()]
+    if jobs <= 1:
+        for filename in filenames:
+            result = function(filename)
+            if apply is not None:
+                apply(filename, result)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(function, filenames, chunksize=4)
+        for filename, result in zip(filenames, results):
+            if apply is not None:
+                apply(filename, result)
 
 
 def parse_args():
@@ -102,17 +140,25 @@ def parse_args():
         formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('input', default='.', nargs='?', help="input file/folder")
     parser.add_argument('-d', '--decrypt', action='store_true', help="decrypt protected pdfs")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="number of worker processes (default: 1, no parallelism)")
     return parser.parse_args()
 
 
 def main():
     colorama.init()
     args = parse_args()
-    function = decrypt_pdf if args.decrypt else rename_pdf
     if os.path.isdir(args.input):
-        iterate_folder(args.input, function)
+        if args.decrypt:
+            iterate_folder(args.input, decrypt_pdf, jobs=args.jobs)
+        else:
+            # Metadata is read in parallel, but files are renamed sequentially, so that
+            # two pdfs with the same metadata cannot overwrite each other
+            iterate_folder(args.input, pdf_new_name, rename_pdf, jobs=args.jobs)
     elif args.input.endswith('.pdf'):
-        function(args.input)
+        if args.decrypt:
+            decrypt_pdf(args.input)
+        else:
+            rename_pdf(args.input)
 
 
 if __name__ == "__main__":
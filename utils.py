@@ -5,10 +5,16 @@
 import re
 import os
 import sys
-import glob
-import shutil
-import filecmp
+import json
+import time
+import bisect
+import threading
+import sqlite3
+import hashlib
 import difflib
+import functools
+import collections
+import contextlib
 import unicodedata
 
 # Third party libs
@@ -17,6 +23,17 @@ import bibtexparser
 from loguru import logger
 from bibtexparser.bwriter import BibTexWriter
 from bibtexparser.bparser import BibTexParser
+from bibtexparser.bibdatabase import BibDatabase
+
+# Optional third party libs
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:
+    fuzz = process = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Local libs
 import latex
@@ -60,21 +77,188 @@ MONTHS_FULL = [
     'December',
 ]
 
+CACHE_FILE = '.autobib_cache.sqlite'
+
+# Entry types kept by bibtexparser (other types are ignored when parsing)
+STANDARD_TYPES = frozenset([
+    'article',
+    'book',
+    'booklet',
+    'conference',
+    'inbook',
+    'incollection',
+    'inproceedings',
+    'manual',
+    'mastersthesis',
+    'misc',
+    'phdthesis',
+    'proceedings',
+    'techreport',
+    'unpublished',
+])
+
+# Lines of a bibtex file written by write_bib
+FAST_ENTRY_RE = re.compile('@([a-z]+)\\{([^,\\s{}]+),')
+FAST_FIELD_RE = re.compile('\t([a-z0-9_-]+) = \\{(.*)\\},?')
+
+# Bibtex databases read during this run, serialized as json {(path, parser): ((mtime, size), data)}
+_BIB_CACHE = {}
+_BIB_CACHE_LOCK = threading.Lock()
+
+# Version of the parsed databases stored in the user-wide cache. Bump it whenever
+# the parsing, the homogenization of the entries, or their serialization changes.
+BIB_CACHE_VERSION = 1
+
+# Connection to the user-wide cache (None until opened, False if it cannot be opened)
+_USER_CACHE = None
+_USER_CACHE_LOCK = threading.Lock()
+
+# Escape colons in the 'file' field
+ESCAPE_COLON = str.maketrans({':': '\\:'})
+
 
 def strip_accents(s):
-    return ''.join(c for c in unicodedata.normalize('NFD', s)
-                   if unicodedata.category(c) != 'Mn')
+    if s.isascii():
+        return s
+    category = unicodedata.category
+    return ''.join(c for c in unicodedata.normalize('NFD', s) if category(c) != 'Mn')
+
+
+def compose_accents(s):
+    """
+    Return the NFC normal form of a string, so that precomposed and decomposed
+    accents compare equal.
+    """
+    if s.isascii():
+        return s
+    return unicodedata.normalize('NFC', s)
+
+
+def is_pdf(entry):
+    """
+    Check whether a directory entry (os.DirEntry) is a non-hidden pdf file.
+    """
+    return entry.name.endswith('.pdf') and not entry.name.startswith('.') and entry.is_file()
+
+
+def pdf_names(entries):
+    """
+    Filter the pdf files amongst a list of directory entries.
+
+    Args:
+        entries (list): list of os.DirEntry, as returned by os.scandir.
+
+    Returns:
+        The list of names of the (non-hidden) pdf files.
+    """
+    return [e.name for e in entries if is_pdf(e)]
+
+
+def has_pdfs(folder, entries=None):
+    """
+    Check whether a folder contains pdfs to process.
+
+    Args:
+        folder (str): path of the folder to inspect.
+        entries (list): content of the folder, if it has already been listed with os.scandir.
+
+    Returns:
+        True if the folder contains pdf files or a `.biblist` file.
+    """
+    if entries is None:
+        with os.scandir(folder) as it:
+            return any(e.name == '.biblist' or is_pdf(e) for e in it)
+    return any(e.name == '.biblist' or is_pdf(e) for e in entries)
 
 
-def has_pdfs(folder):
-    return (os.path.exists(os.path.join(folder, '.biblist')) or
-            len(glob.glob(os.path.join(folder, "*.pdf"))) > 0)
+def walk_bibdirs(root):
+    """
+    Walk a folder tree top-down, like os.walk, but skip folders which contain a
+    file named `.nobib` (their subfolders are still visited). Each folder is
+    listed only once with os.scandir.
+
+    Args:
+        root (str): relative or absolute path of the folder tree to walk.
+
+    Yields:
+        Tuples (subdir, entries), where entries is the list of os.DirEntry
+        objects contained in subdir.
+    """
+    stack = [root]
+    while stack:
+        subdir = stack.pop()
+        try:
+            with os.scandir(subdir) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        # Do not follow symbolic links to folders, as os.walk
+        children = [e.path for e in entries if e.is_dir() and not e.is_symlink()]
+        stack.extend(reversed(children))
+        if not any(e.name == '.nobib' for e in entries):
+            yield subdir, entries
+
+
+def fuzz_scorer():
+    """
+    Return the rapidfuzz scorer used to compare filenames, as set in config.py.
+    """
+    return getattr(fuzz, config.filename_scorer)
 
 
+@functools.lru_cache(maxsize=65536)
 def simratio(file1, file2):
+    if fuzz is not None:
+        return fuzz_scorer()(file1.lower(), file2.lower()) / 100.0
     return difflib.SequenceMatcher(None, file1.lower(), file2.lower()).ratio()
 
 
+def similarity_matrix(queries, choices):
+    """
+    Compute the similarity ratio of each query with each choice.
+
+    Args:
+        queries (list): list of strings to match.
+        choices (list): list of candidate strings.
+
+    Returns:
+        A list of rows, where scores[i][j] is the similarity of queries[i] with choices[j].
+    """
+    if process is not None:
+        scores = []
+        for query in queries:
+            row = [0.0] * len(choices)
+            for _choice, sc, j in process.extract(query, choices, scorer=fuzz_scorer(), processor=str.lower, limit=None):
+                row[j] = sc / 100.0
+            scores.append(row)
+        return scores
+    return [[simratio(query, choice) for choice in choices] for query in queries]
+
+
+def greedy_matching(scores):
+    """
+    Greedily match queries to choices, starting with the most similar pairs, so
+    that each query and each choice is matched at most once.
+
+    Args:
+        scores (list): similarity matrix, as returned by `similarity_matrix`.
+
+    Returns:
+        A dictionary {i: j} mapping the index of each matched query to the index
+        of its matched choice.
+    """
+    pairs = [(sc, i, j) for i, row in enumerate(scores) for j, sc in enumerate(row)]
+    pairs.sort(key=lambda x: -x[0])
+    matching = {}
+    used = set()
+    for _sc, i, j in pairs:
+        if i in matching or j in used:
+            continue
+        matching[i] = j
+        used.add(j)
+    return matching
+
+
 def get_title(record):
     title = record['title']
     if 'booktitle' in record and record['ENTRYTYPE'] == 'book':
@@ -97,12 +281,23 @@ def most_similar_filename(guess, candidates):
         A tuple (match, score), with the name of the most similar match in the
         given list, and the score of such a match.
     """
-    best_score = 0.0
-    best_file = ""
     if isinstance(candidates, str):
         candidates = get_pdf_list(candidates)
+    if process is not None:
+        res = process.extractOne(guess, candidates, scorer=fuzz_scorer(), processor=str.lower)
+        if res is not None and res[1] > 0:
+            return res[0], res[1] / 100.0
+        return "", 0.0
+    # Share the lowercased guess, and skip the full ratio computation when its
+    # cheap upper bounds show that a candidate cannot beat the best match so far
+    best_score = 0.0
+    best_file = ""
+    matcher = difflib.SequenceMatcher(None, guess.lower(), '')
     for file in candidates:
-        sc = simratio(guess, file)
+        matcher.set_seq2(file.lower())
+        if matcher.real_quick_ratio() <= best_score or matcher.quick_ratio() <= best_score:
+            continue
+        sc = matcher.ratio()
         if sc > best_score:
             best_score = sc
             best_file = file
@@ -115,44 +310,98 @@ def get_pdf_list(folder):
     Additionally, if the folder contains a file named ".biblist", reads
     the content of the file as additional pdfs to process.
     """
-    all_pdfs = [os.path.basename(x) for x in glob.glob(os.path.join(folder, "*.pdf"))]
-    biblist_file = os.path.join(folder, '.biblist')
-    if os.path.exists(biblist_file):
-        with open(biblist_file, 'r') as f:
+    with os.scandir(folder) as it:
+        entries = list(it)
+    all_pdfs = pdf_names(entries)
+    # The listing tells whether there is a .biblist, no need to probe for it
+    if any(e.name == '.biblist' for e in entries):
+        with open(os.path.join(folder, '.biblist'), 'r') as f:
             for line in f:
                 all_pdfs.append(line.rstrip())
     return sorted(all_pdfs)
 
 
-def multireplace(string, replacements):
+def replacements_regex(replacements):
     """
-    Given a string and a replacement map, it returns the replaced string.
-    Taken from https://gist.github.com/bgusach/a967e0587d6e01e889fd1d776c5f3729
+    Compile a regex matching any of the substrings to replace, in a single pass.
+    Compile it once and reuse it when the same replacements are applied repeatedly.
 
     Args:
-        string (str): string to execute replacements on
         replacements (dict): replacement dictionary {value to find: value to replace}
 
     Returns:
-        The replaced string.
+        A compiled regular expression.
     """
 
     # Place longer ones first to keep shorter substrings from matching where the
     # longer ones should take place. For instance given the replacements
     # {'ab': 'AB', 'abc': 'ABC'} against the string 'hey abc', it should produce
     # 'hey ABC' and not 'hey ABc'.
-    substrs = sorted(replacements, key=len, reverse=True)
+    return compile_substrings(tuple(sorted(replacements, key=len, reverse=True)))
 
-    # Create a big OR regex that matches any of the substrings to replace.
-    regexp = re.compile('|'.join(map(re.escape, substrs)))
+
+@functools.lru_cache(maxsize=32)
+def compile_substrings(substrs):
+    """
+    Create a big OR regex that matches any of the given substrings, tried in order.
+    """
+    return re.compile('|'.join(map(re.escape, substrs)))
+
+
+def multireplace(string, replacements, regexp=None):
+    """
+    Given a string and a replacement map, it returns the replaced string.
+    Taken from https://gist.github.com/bgusach/a967e0587d6e01e889fd1d776c5f3729
+
+    Args:
+        string (str): string to execute replacements on
+        replacements (dict): replacement dictionary {value to find: value to replace}
+        regexp (re.Pattern): regex returned by `replacements_regex(replacements)`, if already compiled.
+
+    Returns:
+        The replaced string.
+    """
+    if regexp is None:
+        regexp = replacements_regex(replacements)
 
     # For each match, look up the new string in the replacements.
-    return regexp.sub(lambda match: replacements[re.escape(match.group(0))], string)
+    return regexp.sub(lambda match: replacements[match.group(0)], string)
+
+
+def json_dumps(obj):
+    """
+    Serialize an object to a pretty-printed json string with sorted keys.
+    Uses orjson when available, which is much faster than the json module.
+    Both backends give the same layout (orjson only supports a 2-space indent),
+    but may format some floats differently (e.g. 1e-07 vs 1e-7).
+
+    Args:
+        obj: object to serialize.
+
+    Returns:
+        The json string.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2).decode('utf-8')
+    return json.dumps(obj, sort_keys=True, indent=2, separators=(',', ': '), ensure_ascii=False)
+
+
+def file_digest(filename):
+    """
+    Compute the SHA-256 digest of a file, reading it by chunks.
+    """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            h.update(chunk)
+    return h.digest()
 
 
 def write_with_backup(filename, new_content, use_backup=True):
     """
-    Backup the given text file, provided it differs from new_content.
+    Write new_content to the given text file, after backing up the file,
+    provided it differs from new_content. Nothing is written if the file is
+    already up to date.
 
     Args:
         filename (str): absolute or relative path the file to backup.
@@ -160,29 +409,43 @@ def write_with_backup(filename, new_content, use_backup=True):
         use_backup (bool): whether to actually backup the file or not.
     """
 
-    # Find new backup filename
-    if use_backup:
-        backup = filename + '.bak'
-        if os.path.exists(backup):
-            index = 1
-            while os.path.exists(backup):
-                # If a backuped file has similar content, no need to do a new backup
-                if filecmp.cmp(filename, backup, shallow=False):
+    # Encode the content as a text-mode write would
+    new_bytes = new_content.replace('\n', os.linesep).encode('utf-8')
+
+    if os.path.exists(filename):
+        # If file to write is similar to the file to overwrite, do nothing
+        size = os.path.getsize(filename)
+        if size == len(new_bytes):
+            with open(filename, 'rb') as file:
+                if file.read() == new_bytes:
                     return
-                backup = filename + '.bak.' + str(index)
+
+        # Otherwise backup current file, unless a backuped file has similar content
+        if use_backup:
+            # List the existing backups in one pass, instead of probing each index
+            folder, basename = os.path.split(filename)
+            with os.scandir(folder or '.') as it:
+                backups = {e.name: e for e in it if e.name.startswith(basename + '.bak')}
+            digest = None
+            name = basename + '.bak'
+            index = 1
+            while name in backups:
+                # Only hash the files whose size match
+                if backups[name].stat().st_size == size:
+                    digest = digest or file_digest(filename)
+                    if file_digest(backups[name].path) == digest:
+                        break
+                name = basename + '.bak.' + str(index)
                 index += 1
-        if os.path.exists(filename):
-            if new_content == open(filename, encoding='utf-8').read():
-                # If file to write is similar to the file to overwrite, do nothing
-                return
-            else:
-                # Otherwise backup current file
+            if name not in backups:
+                backup = os.path.join(folder, name)
                 print('Backing up "' + os.path.basename(filename) + '"')
-                shutil.move(filename, backup)
+                os.replace(filename, backup)
 
     # Write new content
-    with open(filename, 'w', encoding='utf-8') as file:
-        file.write(new_content)
+    with open(filename, 'wb') as file:
+        file.write(new_bytes)
+    bib_cache_invalidate(filename)
 
 
 def sort_entries(db, order_entries_by):
@@ -196,21 +459,31 @@ def sort_entries(db, order_entries_by):
     Returns:
         Nothing, but update the entries attribute of the input db.
     """
-    def entry_sort_key(entry, fields):
-        result = []
-        for field in fields:
-            if field == 'year':
-                result.append(-int(entry.get(field, 0)))
-            else:
-                result.append(TEXT_TYPE(entry.get(field, '')).lower())
-        return tuple(result)
-    db.entries = sorted(db.entries, key=lambda x: entry_sort_key(x, order_entries_by))
+    def year_key(entry):
+        try:
+            return -int(entry.get('year', 0) or 0)
+        except ValueError:
+            return 0
+
+    if not order_entries_by:
+        return
+    # Extract each sort field in a single pass, then sort the entry indices
+    columns = []
+    for field in order_entries_by:
+        if field == 'year':
+            columns.append([year_key(entry) for entry in db.entries])
+        else:
+            columns.append([TEXT_TYPE(entry.get(field, '')).lower() for entry in db.entries])
+    keys = list(zip(*columns))
+    order = sorted(range(len(db.entries)), key=keys.__getitem__)
+    db.entries = [db.entries[i] for i in order]
 
 
 def create_file_dict(db):
     """
     Generates a dictionary that maps a decoded file field to its index in the
-    given database entry list.
+    given database entry list. Build it once and reuse it to look up entries by
+    filename in constant time, instead of scanning the entry list.
 
     Args:
         db (BibDatabase): the database whose to index.
@@ -219,8 +492,10 @@ def create_file_dict(db):
          A dictionary {filename: id} mapping decoded file fields to their index
          in the input database.
     """
-    gen = ((i, x) for i, x in enumerate(db.entries) if 'file' in x)
-    files = {decode_filename_field(x['file']): i for i, x in gen}
+    files = {}
+    for i, entry in enumerate(db.entries):
+        if 'file' in entry:
+            files[decode_filename_field(entry['file'])] = i
     return files
 
 
@@ -240,31 +515,25 @@ def guess_manual_files(folder, queried_db, update_queried_db=True):
     manual_bib_path = os.path.join(folder, '.manual.bib')
     if os.path.exists(manual_bib_path):
         manual_database = read_bib_file(manual_bib_path, homogenize=True)
+        pdfs = get_pdf_list(folder)
+        queried_files = sorted(files)
         for entry in manual_database.entries:
             guess = nomenclature.gen_filename(entry)
             logger.warning("Try to find a match for manual entry: {}", guess)
-            queried_best_score = 0.0
-            queried_best_idx = -1
-            queried_best_key = None
             # Find the entry from .queried that is the most similar to the manual entry
-            for key, idx in sorted(files.items()):
-                sc = simratio(key, guess)
-                if sc > queried_best_score:
-                    queried_best_score = sc
-                    queried_best_idx = idx
-                    queried_best_key = key
+            queried_best_key, queried_best_score = most_similar_filename(guess, queried_files)
+            queried_best_idx = files[queried_best_key] if queried_best_score > 0 else -1
             # Find most similar filename in the folder being processed
-            match, match_score = most_similar_filename(guess, folder)
+            match, match_score = most_similar_filename(guess, pdfs)
             if match_score < 0.9:
                 logger.warning("Cannot find a file matching manual entry (simratio: {}).\n- Entry: {}\n- Match: {}", match_score, guess, match)
-                res = None
-                while res not in ['y', 'n']:
-                    res = input("Use best match for this entry? [y/n]")
-                if res == 'n':
+                if not confirm("Use best match for this entry? [y/n]", default=None):
                     continue
             else:
                 logger.info("Found a file matching manual entry: {}", guess)
             entry['file'] = encode_filename_field(match)
+            if match not in files:
+                bisect.insort(queried_files, match)
             files[match] = -1
             # If best match is good enough, override queried entry with the manual one
             if update_queried_db:
@@ -273,10 +542,7 @@ def guess_manual_files(folder, queried_db, update_queried_db=True):
                     queried_db.entries[queried_best_idx] = entry
                 elif queried_best_idx >= 0 and queried_best_score > 0.80:
                     logger.warning("Could not find a query matching manual entry (simratio: {}).\n- Entry: {}\n- Query: {}", queried_best_score, guess, queried_best_key)
-                    res = None
-                    while res not in ['y', 'n']:
-                        res = input("Replace this query with the manual entry? [y/n]")
-                    if res == 'y':
+                    if confirm("Replace this query with the manual entry? [y/n]", default=None):
                         queried_db.entries[queried_best_idx] = entry
                     else:
                         queried_db.entries.append(entry)
@@ -293,8 +559,8 @@ def add_skip_files(folder, files):
     skip_path = os.path.join(folder, '.skip.txt')
     if os.path.isfile(skip_path):
         with open(skip_path, 'r', encoding='utf-8') as f:
-            for x in f.read().splitlines():
-                files[x] = -1
+            for line in f:
+                files[line.rstrip('\n')] = -1
 
 
 def read_bib_file(filename, homogenize=False):
@@ -309,9 +575,16 @@ def read_bib_file(filename, homogenize=False):
         A BibDatabase object.
     """
 
+    # Reuse the database parsed during a previous run if the file is unchanged
+    exists = os.path.exists(filename)
+    if exists:
+        db = bib_cache_get(filename, homogenize)
+        if db is not None:
+            return db
+
     # Read input bibtex file
     bibtex_str = " "
-    if os.path.exists(filename):
+    if exists:
         with open(filename, 'r', encoding='utf-8') as bibfile:
             bibtex_str = bibfile.read()
     bibtex_str += " "
@@ -323,7 +596,68 @@ def read_bib_file(filename, homogenize=False):
         parser.customization = nomenclature.homogenize_latex_encoding
 
     # Create database from string
-    return bibtexparser.loads(bibtex_str, parser=parser)
+    db = None
+    if not homogenize:
+        db = read_bib_fast(bibtex_str)
+    if db is None:
+        db = bibtexparser.loads(bibtex_str, parser=parser)
+    if exists:
+        bib_cache_put(filename, homogenize, db)
+    return db
+
+
+def read_bib_fast(bibtex_str):
+    """
+    Parse a bibtex string written by `write_bib` without going through
+    bibtexparser, which is very slow on large files. Only the exact layout
+    produced by `write_bib` is accepted (one field per line, braced values,
+    standard entry types), anything else should be read with bibtexparser.
+
+    Args:
+        bibtex_str (str): content of the bibtex file.
+
+    Returns:
+        A BibDatabase object, or None if the string cannot be parsed this way.
+    """
+    entries = []
+    entry = None
+    for line in bibtex_str.strip().split('\n'):
+        if entry is None:
+            if not line:
+                continue
+            match = FAST_ENTRY_RE.fullmatch(line)
+            if not match or match.group(1) not in STANDARD_TYPES:
+                return None
+            entry = {'ENTRYTYPE': match.group(1), 'ID': match.group(2)}
+        elif line == '}':
+            entries.append(entry)
+            entry = None
+        else:
+            match = FAST_FIELD_RE.fullmatch(line)
+            if not match:
+                return None
+            value = match.group(2)
+            if value != value.strip() or not latex.has_balanced_braces(value):
+                return None
+            entry[match.group(1)] = value
+    if entry is not None:
+        return None
+    db = BibDatabase()
+    db.entries = entries
+    # Make sure nothing was lost: writing the database back must give the input
+    if bib_writer().write(db).strip() != bibtex_str.strip():
+        return None
+    return db
+
+
+def bib_writer():
+    """
+    Create the BibTexWriter used to write bibtex files.
+    """
+    writer = BibTexWriter()
+    writer.indent = '\t'
+    writer.order_entries_by = None
+    return writer
 
 
 def write_bib(db, order=False):
@@ -339,9 +673,7 @@ def write_bib(db, order=False):
     """
 
     # Custom writer
-    writer = BibTexWriter()
-    writer.indent = '\t'
-    writer.order_entries_by = None
+    writer = bib_writer()
 
     # Replace month by numeric value
     for entry in db.entries:
@@ -377,7 +709,7 @@ def encode_filename_field(filename):
         A string which corresponds to the escaped field to be used
     """
     assert filename.endswith(".pdf")
-    return ':' + filename.replace(':', '\\:') + ':PDF'
+    return ':' + filename.translate(ESCAPE_COLON) + ':PDF'
 
 
 def decode_filename_field(text):
@@ -391,9 +723,9 @@ def decode_filename_field(text):
         A string which corresponds to the decoded file name.
     """
     assert text.endswith(":PDF")
-    match = re.search(':(.*):PDF', text)
-    assert match
-    filename = match.group(1).replace('\\:', ':')
+    start = text.find(':') + 1
+    assert 0 < start <= len(text) - 4
+    filename = text[start:-4].replace('\\:', ':')
     return filename
 
 
@@ -402,36 +734,344 @@ def fix_author_field(res_bib, res_json):
     Attempt to fix some defects when the author name is given in an ambiguous
     manner in the bibtex entry. To this end, it uses the matching json entry.
     Only for Crossref entries (needs the json data).
+
+    Returns:
+        A string with the warnings raised while fixing the author names (empty if none).
     """
 
-    def process_pair(author_bib, author_json, msg):
+    def process_pair(author_bib, author_json):
         if ',' in author_bib:
             # Assume entry is correct already
-            return author_bib
-        elif sorted(author_json.keys()) != ['affiliation', 'family', 'given']:
+            return author_bib, None
+        elif len(author_json) != 3 or sorted(author_json.keys()) != ['affiliation', 'family', 'given']:
             # Author entry contains extra information
-            msg += termcolor.colored('W: Too much info in author json entry:', 'yellow') + '\n'
-            msg += "JSON: " + str(author_json) + '\n'
-            return author_bib
+            msg = termcolor.colored('W: Too much info in author json entry:', 'yellow') + '\n'
+            msg += "JSON: " + str(author_json)
+            return author_bib, msg
         elif not author_bib.endswith(author_json['family']):
             # Mismatched family name between json and bibtex
-            msg += termcolor.colored('W: Potential mismatched family name in author entry:', 'yellow') + '\n'
+            msg = termcolor.colored('W: Potential mismatched family name in author entry:', 'yellow') + '\n'
             msg += "BIB : " + author_bib + '\n'
-            msg += "JSON: " + str(author_json) + '\n'
-            return author_bib
+            msg += "JSON: " + str(author_json)
+            return author_bib, msg
         else:
             # All good, let's remove the ambiguity
             old_name = author_json['given'] + ' ' + author_json['family']
             new_name = author_json['family'] + ", " + author_json['given']
+            msg = None
             if old_name != author_bib or len(author_json['family'].split()) > 1:
                 s = "I: Author name changed from [" + author_bib + "] to [" + new_name + "]"
-                msg += termcolor.colored(s, 'yellow')
-            return new_name
+                msg = termcolor.colored(s, 'yellow')
+            return new_name, msg
+
+    pairs = list(map(process_pair, res_bib['author'].split(' and '), res_json['author']))
+    res_bib['author'] = ' and '.join(name for name, _ in pairs)
+    return '\n'.join(msg for _, msg in pairs if msg)
+
+
+def query_cache_key(authors, title):
+    """
+    Compute the key identifying an online query in the query cache. The query
+    is normalized (case, whitespace, order of the authors) so that files whose
+    names differ only cosmetically share the same cache entry.
+
+    Args:
+        authors (list): a list of strings for up the first authors last names.
+        title (str): the title of the article.
+
+    Returns:
+        A hex digest of the query.
+    """
+    query = ' '.join(sorted(a.lower() for a in authors)) + '|' + ' '.join(title.lower().split())
+    return hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+
+@contextlib.contextmanager
+def query_cache(folder):
+    """
+    Open (and create if needed) the query cache of the given folder, for the
+    duration of a command.
+
+    Args:
+        folder (str): folder where the cache is stored.
+
+    Yields:
+        A sqlite3 connection to pass to `query_cache_get` and `query_cache_put`,
+        or None if the cache cannot be opened (e.g. in a read-only folder).
+    """
+    conn = None
+    try:
+        conn = sqlite3.connect(os.path.join(folder, CACHE_FILE))
+        conn.execute('CREATE TABLE IF NOT EXISTS queries ('
+                     'provider TEXT, key TEXT, rbib TEXT, rjson TEXT, score REAL, ts REAL, '
+                     'PRIMARY KEY (provider, key))')
+    except sqlite3.Error as err:
+        logger.warning("Cannot open query cache in {}: {}", folder, err)
+        if conn is not None:
+            conn.close()
+        conn = None
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def query_cache_get(conn, provider, key):
+    """
+    Retrieve the result of a previous online query from the cache.
+
+    Args:
+        conn (sqlite3.Connection): connection returned by `query_cache` (or None).
+        provider (str): name of the online database that was queried.
+        key (str): key of the query, as returned by `query_cache_key`.
+
+    Returns:
+        A tuple (bibtex, json, score) as returned by the provider, or None if
+        the query is not in the cache or has expired.
+    """
+    if conn is None:
+        return None
+    try:
+        row = conn.execute('SELECT rbib, rjson, score, ts FROM queries WHERE provider = ? AND key = ?',
+                           (provider, key)).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None or time.time() - row[3] > config.query_cache_ttl:
+        return None
+    return (json.loads(row[0]), json.loads(row[1]), row[2])
+
+
+def query_cache_put(conn, provider, key, rbib, rjson, score):
+    """
+    Store the result of an online query in the cache.
+
+    Args:
+        conn (sqlite3.Connection): connection returned by `query_cache` (or None).
+        provider (str): name of the online database that was queried.
+        key (str): key of the query, as returned by `query_cache_key`.
+        rbib (dict): bibtex record returned by the query (or None).
+        rjson (dict): json data returned by the query (or None).
+        score (float): score of the match.
+    """
+    if conn is None:
+        return
+    try:
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?, ?)',
+                         (provider, key, json.dumps(rbib), json.dumps(rjson), score, time.time()))
+    except sqlite3.Error:
+        pass
+
+
+def user_cache():
+    """
+    Return the connection to the user-wide cache (see `cache_file` in config.py),
+    opening it on first use. The connection is shared by all threads, so it must
+    only be used while holding _USER_CACHE_LOCK.
+
+    Returns:
+        A sqlite3 connection, or None if the cache is disabled or cannot be opened.
+    """
+    global _USER_CACHE
+    if _USER_CACHE is None:
+        _USER_CACHE = False
+        if config.cache_file:
+            filename = os.path.expanduser(config.cache_file)
+            try:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                conn = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+                conn.execute('CREATE TABLE IF NOT EXISTS dois (doi TEXT PRIMARY KEY, bib TEXT)')
+                # Parsed databases written by another version of the code may be stale
+                if conn.execute('PRAGMA user_version').fetchone()[0] != BIB_CACHE_VERSION:
+                    with conn:
+                        conn.execute('DROP TABLE IF EXISTS bibs')
+                        conn.execute('PRAGMA user_version = {0}'.format(BIB_CACHE_VERSION))
+                conn.execute('CREATE TABLE IF NOT EXISTS bibs ('
+                             'path TEXT, parser TEXT, mtime INTEGER, size INTEGER, db TEXT, '
+                             'PRIMARY KEY (path, parser))')
+                _USER_CACHE = conn
+            except (sqlite3.Error, OSError) as err:
+                logger.warning("Cannot open cache file {}: {}", filename, err)
+    return _USER_CACHE or None
+
+
+def doi_cache_get(doi):
+    """
+    Retrieve the bibtex entry previously downloaded for a DOI. Unlike query
+    results, these never expire, since the entry of a given DOI does not change.
 
-    msg = ""
-    author_list = res_bib['author'].split(' and ')
-    author_list = [process_pair(a, b, msg) for a, b in zip(author_list, res_json['author'])]
-    res_bib['author'] = ' and '.join(author_list)
+    Args:
+        doi (str): the DOI of the article.
+
+    Returns:
+        The bibtex entry as a string, or None if the DOI is not in the cache.
+    """
+    with _USER_CACHE_LOCK:
+        conn = user_cache()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute('SELECT bib FROM dois WHERE doi = ?', (doi.lower(),)).fetchone()
+        except sqlite3.Error:
+            return None
+    return row[0] if row is not None else None
+
+
+def doi_cache_put(doi, bib):
+    """
+    Store the bibtex entry downloaded for a DOI.
+
+    Args:
+        doi (str): the DOI of the article.
+        bib (str): the bibtex entry, as returned by the content negotiation.
+    """
+    with _USER_CACHE_LOCK:
+        conn = user_cache()
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO dois VALUES (?, ?)', (doi.lower(), bib))
+        except sqlite3.Error:
+            pass
+
+
+def bib_cache_parser(homogenize):
+    """
+    Identify the parser used to read a bibtex file in the cache. Homogenized
+    entries depend on the capitalization rules defined in config.py.
+    """
+    if not homogenize:
+        return ''
+    rules = repr((config.uppercase_words, config.lowercase_words, config.mixedcase_words))
+    return hashlib.sha1(rules.encode('utf-8')).hexdigest()
+
+
+def bib_to_json(db):
+    """
+    Serialize a bibtex database to a json string, to store it in the cache.
+    """
+    return json.dumps({
+        'entries': db.entries,
+        'comments': db.comments,
+        'preambles': db.preambles,
+        'strings': list(db.strings.items()),
+    })
+
+
+def bib_from_json(data):
+    """
+    Create a bibtex database from a json string returned by `bib_to_json`.
+    """
+    obj = json.loads(data)
+    db = BibDatabase()
+    db.entries = obj['entries']
+    db.comments = obj['comments']
+    db.preambles = obj['preambles']
+    db.strings = collections.OrderedDict(obj['strings'])
+    return db
+
+
+def bib_cache_get(filename, homogenize):
+    """
+    Retrieve a parsed bibtex database from the cache, provided the file has not
+    been modified since it was cached. Databases already retrieved during the
+    current run are kept in memory.
+
+    Args:
+        filename (str): path of the bibtex file.
+        homogenize (bool): whether the entries were homogenized upon reading.
+
+    Returns:
+        A BibDatabase object, or None if the file is not in the cache.
+    """
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), bib_cache_parser(homogenize))
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _BIB_CACHE_LOCK:
+        cached = _BIB_CACHE.get(key)
+    if cached is not None and cached[0] == stamp:
+        return bib_from_json(cached[1])
+    with _USER_CACHE_LOCK:
+        conn = user_cache()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute('SELECT db FROM bibs WHERE path = ? AND parser = ? AND mtime = ? AND size = ?',
+                               key + stamp).fetchone()
+        except sqlite3.Error:
+            return None
+    if row is None:
+        return None
+    with _BIB_CACHE_LOCK:
+        _BIB_CACHE[key] = (stamp, row[0])
+    return bib_from_json(row[0])
+
+
+def bib_cache_put(filename, homogenize, db):
+    """
+    Store a parsed bibtex database in the cache.
+
+    Args:
+        filename (str): path of the bibtex file.
+        homogenize (bool): whether the entries were homogenized upon reading.
+        db (BibDatabase): the parsed database.
+    """
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), bib_cache_parser(homogenize))
+    stamp = (st.st_mtime_ns, st.st_size)
+    try:
+        data = bib_to_json(db)
+    except TypeError:
+        # Some values are not plain strings, do not cache this database
+        return
+    with _BIB_CACHE_LOCK:
+        _BIB_CACHE[key] = (stamp, data)
+    with _USER_CACHE_LOCK:
+        conn = user_cache()
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO bibs VALUES (?, ?, ?, ?, ?)', key + stamp + (data,))
+        except sqlite3.Error:
+            pass
+
+
+def bib_cache_invalidate(filename):
+    """
+    Discard the in-memory cached databases of a bibtex file that was just written.
+    """
+    path = os.path.abspath(filename)
+    with _BIB_CACHE_LOCK:
+        for key in [k for k in _BIB_CACHE if k[0] == path]:
+            del _BIB_CACHE[key]
+
+
+def confirm(prompt, default=True):
+    """
+    Ask the user for a yes/no confirmation.
+
+    Args:
+        prompt (str): message to display.
+        default (bool): answer assumed when the user simply presses enter. If
+            None, the question is repeated until the user answers 'y' or 'n'.
+
+    Returns:
+        True if the user answered yes (always the case if config.assume_yes is set).
+    """
+    if config.assume_yes:
+        print(prompt + 'y')
+        return True
+    while True:
+        cmd = input(prompt)
+        if cmd in ('y', 'Y'):
+            return True
+        if default is not None:
+            return default if cmd == '' else False
+        if cmd in ('n', 'N'):
+            return False
 
 
 def write_remap_script(subst, output_folder):
@@ -444,8 +1084,7 @@ def write_remap_script(subst, output_folder):
     s = """find . -name "*.tex" -exec sed -i 's/{0}/{1}/g' {{}} \\;"""
     outfile = os.path.join(output_folder, "remap.sh")
     if os.path.exists(outfile):
-        cmd = input("overwrite existing file '{0}' (y/N) ".format(outfile))
-        if cmd != 'y':
+        if not confirm("overwrite existing file '{0}' (y/N) ".format(outfile), default=False):
             return
     with open(outfile, 'w') as f:
         f.write("#! /bin/bash\n\n")